@@ -5,23 +5,33 @@ Module database - Gestion des connexions et sessions
 from .connection import (
     engine,
     SessionLocal,
+    async_engine,
+    AsyncSessionLocal,
     Base,
     get_db,
+    get_async_db,
     get_redis,
+    get_async_redis,
     test_db_connection,
     test_redis_connection,
     init_database,
+    init_redis,
     redis_client
 )
 
 __all__ = [
     "engine",
     "SessionLocal", 
+    "async_engine",
+    "AsyncSessionLocal",
     "Base",
     "get_db",
+    "get_async_db",
     "get_redis",
+    "get_async_redis",
     "test_db_connection",
     "test_redis_connection",
     "init_database",
+    "init_redis",
     "redis_client"
 ]
\ No newline at end of file
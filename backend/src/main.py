@@ -2,43 +2,75 @@
 Application FastAPI principale - Covoiturage CI
 Point d'entrée de l'API
 """
+import asyncio
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware  # ← NOUVEAU !
-from sqlalchemy.orm import Session
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 from decouple import config
 import uvicorn
 
 # Imports internes
-from src.database import get_db, test_db_connection, test_redis_connection
+from src.database import (
+    get_async_db, test_db_connection, test_redis_connection,
+    init_database, init_redis, async_engine, get_async_redis
+)
 from src.config import get_settings
 from src.routers import auth, trip, reservation, geo
+from src.middleware import AuthMiddleware
 
 # Configuration
 settings = get_settings()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Initialisation unique au démarrage : tables, Redis et préchauffage du pool
+    Exécutée en parallèle dans des threads pour ne pas bloquer la boucle
+    """
+    await asyncio.gather(
+        asyncio.to_thread(init_database),
+        asyncio.to_thread(init_redis),
+        asyncio.to_thread(test_db_connection)  # Ouvre une première connexion du pool
+    )
+    yield
+    await async_engine.dispose()
+    async_redis = get_async_redis()
+    if async_redis is not None:
+        await async_redis.aclose()
+
+
 # Création de l'application FastAPI
 app = FastAPI(
     title="Covoiturage CI API",
     description="API pour l'application de covoiturage en Côte d'Ivoire",
     version="1.0.0",
     docs_url="/docs",  # Documentation Swagger
-    redoc_url="/redoc"  # Documentation ReDoc
+    redoc_url="/redoc",  # Documentation ReDoc
+    lifespan=lifespan
 )
 
 # Configuration CORS
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=settings.CORS_ORIGINS,  # Liste explicite (le joker "*" est invalide avec credentials)
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE"],
+    allow_headers=["Authorization", "Content-Type"],
+    max_age=86400,  # Cache des requêtes preflight pendant 24h
 )
 
+# Décodage unique du JWT par requête (payload exposé via ContextVar)
+app.add_middleware(AuthMiddleware)
+
 # Inclusion des routers
-app.include_router(auth.router)
-app.include_router(trip.router) 
-app.include_router(reservation.router)
-app.include_router(geo.router)
+app.include_router(auth.router, prefix="/api/v1/auth", tags=["Authentification"])
+app.include_router(trip.router, prefix="/api/v1/trips", tags=["Trajets"])
+app.include_router(reservation.router, prefix="/api/v1/reservations", tags=["Réservations"])
+app.include_router(geo.router, prefix="/api/v1/geo", tags=["Géolocalisation & Cartes"])
 
 # Routes de santé et de test
 @app.get("/")
@@ -66,11 +98,11 @@ async def health_check():
 async def database_health():
     """Vérification de l'état des bases de données"""
     
-    # Test PostgreSQL
-    db_status = test_db_connection()
-    
-    # Test Redis
-    redis_status = test_redis_connection()
+    # Tests PostgreSQL et Redis en parallèle, hors de la boucle d'événements
+    db_status, redis_status = await asyncio.gather(
+        asyncio.to_thread(test_db_connection),
+        asyncio.to_thread(test_redis_connection)
+    )
     
     # Statut global
     overall_status = "healthy" if (
@@ -86,11 +118,11 @@ async def database_health():
 
 
 @app.get("/health/detailed")
-async def detailed_health(db: Session = Depends(get_db)):
+async def detailed_health(db: AsyncSession = Depends(get_async_db)):
     """Vérification détaillée avec test de requête"""
     try:
         # Test d'une requête simple pour vérifier la session
-        result = db.execute("SELECT 1 as test")
+        result = await db.execute(text("SELECT 1 as test"))
         test_value = result.fetchone()[0]
         
         db_detailed = {
@@ -110,7 +142,7 @@ async def detailed_health(db: Session = Depends(get_db)):
         "database_session": db_detailed,
         "environment": {
             "debug": settings.DEBUG,
-            "database_url": settings.DATABASE_URL.split('@')[-1]  # Masquer credentials
+            "database_url": settings.DATABASE_URL_MASKED
         }
     }
 
@@ -132,43 +164,61 @@ async def api_status():
 
 
 # Gestion globale des erreurs
-from fastapi.responses import JSONResponse
+import json
+from fastapi.responses import Response
+from src.utils.serialization import json_bytes
+
+
+# Corps pré-sérialisés une seule fois ; seul le chemin est inséré pour les 404
+_NOT_FOUND_PREFIX, _NOT_FOUND_SUFFIX = json_bytes({
+    "error": "Endpoint non trouvé",
+    "message": "L'endpoint {path} n'existe pas",
+    "available_endpoints": [
+        "/", "/health", "/health/db", "/docs", "/api/v1/status"
+    ]
+}).split(b"{path}")
+
+_INTERNAL_ERROR_BODY = json_bytes({
+    "error": "Erreur interne du serveur",
+    "message": "Une erreur s'est produite. Consultez les logs.",
+    "contact": "support@covoiturage-ci.com"
+})
+
 
 @app.exception_handler(404)
 async def not_found_handler(request, exc):
-    return JSONResponse(
+    # Échappement JSON du chemin (guillemets retirés)
+    path = json.dumps(request.url.path, ensure_ascii=False)[1:-1].encode("utf-8")
+    return Response(
+        content=_NOT_FOUND_PREFIX + path + _NOT_FOUND_SUFFIX,
         status_code=404,
-        content={
-            "error": "Endpoint non trouvé",
-            "message": f"L'endpoint {request.url.path} n'existe pas",
-            "available_endpoints": [
-                "/", "/health", "/health/db", "/docs", "/api/v1/status"
-            ]
-        }
+        media_type="application/json"
     )
 
 
 @app.exception_handler(500)
 async def internal_error_handler(request, exc):
-    return JSONResponse(
+    # Capte toute exception non gérée des routes (plus de try/except par handler) ;
+    # le détail reste dans les logs du serveur, jamais dans la réponse
+    return Response(
+        content=_INTERNAL_ERROR_BODY,
         status_code=500,
-        content={
-            "error": "Erreur interne du serveur",
-            "message": "Une erreur s'est produite. Consultez les logs.",
-            "contact": "support@covoiturage-ci.com"
-        }
+        media_type="application/json"
     )
 
 
 if __name__ == "__main__":
     """
-    Démarrage de l'application en mode développement
+    Démarrage de l'application
     Usage: python src/main.py
     """
     uvicorn.run(
         "src.main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,  # Rechargement automatique en dev
+        reload=settings.DEBUG,  # Rechargement automatique en dev
+        workers=1 if settings.DEBUG else (os.cpu_count() or 1) * 2 + 1,
+        loop="uvloop",       # Boucle d'événements en C (fournie par uvicorn[standard])
+        http="httptools",    # Parseur HTTP en C
         log_level="info"
     )
\ No newline at end of file
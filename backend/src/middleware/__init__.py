@@ -0,0 +1,10 @@
+"""
+Module middleware - Middlewares ASGI de l'application
+"""
+
+from .auth import AuthMiddleware, get_token_payload
+
+__all__ = [
+    "AuthMiddleware",
+    "get_token_payload"
+]
@@ -0,0 +1,49 @@
+"""
+Middleware d'authentification
+Décode le JWT une seule fois par requête et le rend disponible via un ContextVar
+"""
+from contextvars import ContextVar
+from typing import Optional, Dict, Any
+from fastapi import HTTPException
+
+from src.services.auth import AuthService
+
+# Payload JWT de la requête en cours (None si absent ou invalide)
+_auth_ctx: ContextVar[Optional[Dict[str, Any]]] = ContextVar("auth_payload", default=None)
+
+
+def get_token_payload() -> Optional[Dict[str, Any]]:
+    """Retourne le payload JWT décodé par AuthMiddleware pour la requête en cours"""
+    return _auth_ctx.get()
+
+
+class AuthMiddleware:
+    """
+    Middleware ASGI : vérifie la signature du token Bearer une fois par requête
+    Ne rejette rien lui-même, les dépendances décident (401/403)
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        payload = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer" and token:
+                    try:
+                        payload = AuthService.verify_token(token)
+                    except HTTPException:
+                        payload = None
+                break
+        
+        ctx_token = _auth_ctx.set(payload)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _auth_ctx.reset(ctx_token)
@@ -1,8 +1,9 @@
 """
 Modèle Reservation - Réservations de trajets par les passagers
 """
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Float, ForeignKey, Enum
-from sqlalchemy.orm import relationship
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, SmallInteger, String, Boolean, DateTime, Text, Float, ForeignKey, Enum, Index
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy.sql import func
 import enum
 
@@ -37,19 +38,42 @@ class PaymentStatus(str, enum.Enum):
     REFUNDED = "refunded"     # Remboursé
 
 
+# Ensembles de statuts (évalués une seule fois, recherche O(1))
+_CANCELLABLE = frozenset({
+    ReservationStatus.PENDING,
+    ReservationStatus.CONFIRMED,
+    ReservationStatus.PAID
+})
+_ACTIVE = frozenset({
+    ReservationStatus.PENDING,
+    ReservationStatus.CONFIRMED,
+    ReservationStatus.PAID,
+    ReservationStatus.STARTED
+})
+
+
 class Reservation(Base):
     """
     Modèle réservation - Réservations de trajets par les passagers
     """
     __tablename__ = "reservations"
+    __table_args__ = (
+        # Requêtes par passager/trajet filtrées par statut (listes, réservation active existante)
+        # Ces index couvrent aussi les recherches sur passenger_id / trip_id seuls
+        Index("ix_reservations_passenger_status", "passenger_id", "status"),
+        Index("ix_reservations_trip_status", "trip_id", "status"),
+    )
 
     # Identifiants
     id = Column(Integer, primary_key=True, index=True)
-    trip_id = Column(Integer, ForeignKey("trips.id"), nullable=False, index=True)
-    passenger_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    trip_id = Column(Integer, ForeignKey("trips.id"), nullable=False)
+    passenger_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     
     # Détails de la réservation
-    number_of_seats = Column(Integer, default=1, nullable=False)
+    # SMALLINT (places, notes) : bases existantes converties par
+    #   ALTER TABLE reservations ALTER COLUMN number_of_seats TYPE smallint,
+    #     ALTER COLUMN passenger_rating TYPE smallint, ALTER COLUMN driver_rating TYPE smallint;
+    number_of_seats = Column(SmallInteger, default=1, nullable=False)
     pickup_address = Column(String(255), nullable=True)    # Adresse de prise en charge
     pickup_latitude = Column(Float, nullable=True)
     pickup_longitude = Column(Float, nullable=True)
@@ -63,16 +87,26 @@ class Reservation(Base):
     actual_dropoff_time = Column(DateTime(timezone=True), nullable=True)
     
     # Statut
-    status = Column(Enum(ReservationStatus), default=ReservationStatus.PENDING, nullable=False)
+    status = Column(
+        Enum(ReservationStatus, name="reservationstatus", native_enum=True),  # Type ENUM PostgreSQL natif
+        default=ReservationStatus.PENDING, nullable=False
+    )
     
     # Informations financières
+    # base_price : colonne ajoutée après coup, create_all ne modifie pas une table existante :
+    #   ALTER TABLE reservations ADD COLUMN base_price double precision;
+    #   UPDATE reservations SET base_price = price_per_seat * number_of_seats WHERE base_price IS NULL;
     total_price = Column(Float, nullable=False)            # Prix total à payer
     price_per_seat = Column(Float, nullable=False)         # Prix unitaire (copie du trip)
+    base_price = Column(Float, nullable=True)              # price_per_seat * number_of_seats (maintenu à l'écriture)
     platform_fee = Column(Float, default=0.0, nullable=False)  # Frais de plateforme
     
     # Paiement
-    payment_method = Column(Enum(PaymentMethod), nullable=True)
-    payment_status = Column(Enum(PaymentStatus), default=PaymentStatus.PENDING, nullable=False)
+    payment_method = Column(Enum(PaymentMethod, name="paymentmethod", native_enum=True), nullable=True)
+    payment_status = Column(
+        Enum(PaymentStatus, name="paymentstatus", native_enum=True),
+        default=PaymentStatus.PENDING, nullable=False
+    )
     payment_transaction_id = Column(String(100), nullable=True)  # ID transaction externe
     payment_reference = Column(String(100), nullable=True)       # Référence paiement
     paid_at = Column(DateTime(timezone=True), nullable=True)
@@ -83,8 +117,8 @@ class Reservation(Base):
     driver_notes = Column(Text, nullable=True)             # Notes du conducteur
     
     # Tracking
-    passenger_rating = Column(Integer, nullable=True)      # Note donnée au passager (1-5)
-    driver_rating = Column(Integer, nullable=True)         # Note donnée au conducteur (1-5)
+    passenger_rating = Column(SmallInteger, nullable=True) # Note donnée au passager (1-5)
+    driver_rating = Column(SmallInteger, nullable=True)    # Note donnée au conducteur (1-5)
     passenger_comment = Column(Text, nullable=True)        # Commentaire sur le conducteur
     driver_comment = Column(Text, nullable=True)           # Commentaire sur le passager
     
@@ -105,12 +139,7 @@ class Reservation(Base):
     @property
     def can_be_cancelled(self):
         """Vérifie si la réservation peut être annulée"""
-        cancellable_statuses = [
-            ReservationStatus.PENDING,
-            ReservationStatus.CONFIRMED,
-            ReservationStatus.PAID
-        ]
-        return self.status in cancellable_statuses
+        return self.status in _CANCELLABLE
 
     @property
     def can_be_paid(self):
@@ -128,18 +157,23 @@ class Reservation(Base):
     @property
     def is_active(self):
         """Vérifie si la réservation est active"""
-        active_statuses = [
-            ReservationStatus.PENDING,
-            ReservationStatus.CONFIRMED,
-            ReservationStatus.PAID,
-            ReservationStatus.STARTED
-        ]
-        return self.status in active_statuses
+        return self.status in _ACTIVE
+
+    @validates("number_of_seats", "price_per_seat")
+    def _update_base_price(self, key, value):
+        """Maintient base_price à jour à chaque écriture des places ou du prix"""
+        seats = value if key == "number_of_seats" else self.number_of_seats
+        price = value if key == "price_per_seat" else self.price_per_seat
+        if seats is not None and price is not None:
+            self.base_price = price * seats
+        return value
 
     @property
     def total_amount_breakdown(self):
         """Détail du montant total"""
-        base_amount = self.price_per_seat * self.number_of_seats
+        base_amount = self.base_price
+        if base_amount is None:  # Lignes antérieures à la colonne base_price
+            base_amount = self.price_per_seat * self.number_of_seats
         return {
             "base_price": base_amount,
             "platform_fee": self.platform_fee,
@@ -151,7 +185,7 @@ class Reservation(Base):
         """Confirme la réservation"""
         if self.status == ReservationStatus.PENDING:
             self.status = ReservationStatus.CONFIRMED
-            self.confirmed_at = func.now()
+            self.confirmed_at = datetime.now(timezone.utc)
             return True
         return False
 
@@ -163,7 +197,7 @@ class Reservation(Base):
             else:
                 self.status = ReservationStatus.CANCELLED_BY_DRIVER
             
-            self.cancelled_at = func.now()
+            self.cancelled_at = datetime.now(timezone.utc)
             self.cancellation_reason = reason
             return True
         return False
@@ -173,7 +207,7 @@ class Reservation(Base):
         if self.can_be_paid:
             self.payment_status = PaymentStatus.COMPLETED
             self.status = ReservationStatus.PAID
-            self.paid_at = func.now()
+            self.paid_at = datetime.now(timezone.utc)
             if transaction_id:
                 self.payment_transaction_id = transaction_id
             if payment_method:
@@ -185,7 +219,7 @@ class Reservation(Base):
         """Marque le début du trajet"""
         if self.status == ReservationStatus.PAID:
             self.status = ReservationStatus.STARTED
-            self.actual_pickup_time = func.now()
+            self.actual_pickup_time = datetime.now(timezone.utc)
             return True
         return False
 
@@ -193,7 +227,7 @@ class Reservation(Base):
         """Marque la fin du trajet"""
         if self.status == ReservationStatus.STARTED:
             self.status = ReservationStatus.COMPLETED
-            self.actual_dropoff_time = func.now()
+            self.actual_dropoff_time = datetime.now(timezone.utc)
             return True
         return False
 
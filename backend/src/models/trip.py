@@ -1,13 +1,21 @@
 """
 Modèle Trip - Trajets proposés par les conducteurs
 """
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Float, ForeignKey, Enum
-from sqlalchemy.orm import relationship, declarative_base
+from datetime import datetime, timezone
+from sqlalchemy import (
+    Column, Integer, SmallInteger, String, Boolean, DateTime, Text, Float, ForeignKey, Index,
+    DDL, event, literal, text, update, and_
+)
+from sqlalchemy.orm import relationship, declarative_base, deferred
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 import enum
 
+from src.utils.geo import haversine_km
+
 # Utilisation de la même Base que User
-from .user import Base
+from .user import Base, StringEnum
 
 
 class TripStatus(str, enum.Enum):
@@ -26,15 +34,66 @@ class TripType(str, enum.Enum):
     WEEKLY = "weekly"       # Trajet hebdomadaire
 
 
+# Préférences du trajet (bits de Trip.preferences_mask)
+PREF_PETS = 1
+PREF_SMOKING = 2
+PREF_FOOD = 4
+PREF_LUGGAGE = 8
+DEFAULT_PREFERENCES = PREF_FOOD | PREF_LUGGAGE  # Nourriture et bagages acceptés par défaut
+
+
+def _is_future(moment: datetime) -> bool:
+    """Compare à l'heure actuelle (UTC), que la date soit naïve ou avec fuseau"""
+    if moment.tzinfo is None:
+        return moment > datetime.utcnow()
+    return moment > datetime.now(timezone.utc)
+
+
+def _preference(bit: int) -> hybrid_property:
+    """Booléen adossé à un bit de preferences_mask (lecture, écriture et SQL)"""
+    def fget(self) -> bool:
+        mask = self.preferences_mask if self.preferences_mask is not None else DEFAULT_PREFERENCES
+        return bool(mask & bit)
+
+    def fset(self, value: bool):
+        mask = self.preferences_mask if self.preferences_mask is not None else DEFAULT_PREFERENCES
+        self.preferences_mask = (mask | bit) if value else (mask & ~bit)
+
+    def expr(cls):
+        return cls.preferences_mask.op("&")(bit) != 0
+
+    return hybrid_property(fget, fset, expr=expr)
+
+
 class Trip(Base):
     """
     Modèle trajet - Trajets proposés par les conducteurs
     """
     __tablename__ = "trips"
+    __table_args__ = (
+        # Chemin de recherche principal : status='active' AND departure_datetime > now()
+        Index("ix_trips_status_departure", "status", "departure_datetime"),
+        # Recherche (partiel, trajets actifs) : même ordre que la pagination par clé de search_trips
+        # Les villes sont filtrées en ILIKE '%...%', qu'un index B-tree ne peut pas servir
+        Index(
+            "ix_trips_search", "departure_datetime", "id",
+            postgresql_where=text("status = 'active'")
+        ),
+        # Trajets d'un conducteur par statut, triés par date (get_my_trips)
+        Index("ix_trips_driver_status", "driver_id", "status", "departure_datetime"),
+        # Recherche par proximité : index spatial GiST (extension earthdistance), voir departure_near
+        Index(
+            "ix_trips_departure_earth",
+            text("ll_to_earth(departure_latitude, departure_longitude)"),
+            postgresql_using="gist"
+        ),
+        # Recherche par point d'arrêt : waypoints @> '[{"city": "Bouaké"}]'
+        Index("ix_trips_waypoints_gin", "waypoints", postgresql_using="gin"),
+    )
 
     # Identifiants
     id = Column(Integer, primary_key=True, index=True)
-    driver_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    driver_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     
     # Informations du trajet
     departure_address = Column(String(255), nullable=False)
@@ -48,7 +107,7 @@ class Trip(Base):
     arrival_longitude = Column(Float, nullable=True)
     
     # Timing
-    departure_datetime = Column(DateTime(timezone=True), nullable=False, index=True)
+    departure_datetime = Column(DateTime(timezone=True), nullable=False)
     estimated_duration_minutes = Column(Integer, nullable=True)  # Durée estimée
     actual_departure_time = Column(DateTime(timezone=True), nullable=True)
     actual_arrival_time = Column(DateTime(timezone=True), nullable=True)
@@ -60,22 +119,26 @@ class Trip(Base):
     total_distance_km = Column(Float, nullable=True)   # Distance totale
     
     # Type et statut
-    trip_type = Column(Enum(TripType), default=TripType.ONE_TIME, nullable=False)
-    status = Column(Enum(TripStatus), default=TripStatus.ACTIVE, nullable=False)
+    trip_type = Column(StringEnum(TripType, "ck_trips_trip_type"), default=TripType.ONE_TIME, nullable=False)
+    status = Column(StringEnum(TripStatus, "ck_trips_status"), default=TripStatus.ACTIVE, nullable=False)
     
     # Préférences et règles
-    accepts_pets = Column(Boolean, default=False, nullable=False)
-    accepts_smoking = Column(Boolean, default=False, nullable=False)
-    accepts_food = Column(Boolean, default=True, nullable=False)
-    luggage_allowed = Column(Boolean, default=True, nullable=False)
+    # Un seul entier : filtre SQL (preferences_mask & :masque) = :attendu
+    preferences_mask = Column(SmallInteger, default=DEFAULT_PREFERENCES, nullable=False)
+    accepts_pets = _preference(PREF_PETS)
+    accepts_smoking = _preference(PREF_SMOKING)
+    accepts_food = _preference(PREF_FOOD)
+    luggage_allowed = _preference(PREF_LUGGAGE)
     max_detour_km = Column(Float, default=2.0, nullable=False)  # Détour max pour récupérer passagers
     
     # Informations additionnelles
+    # Colonnes longues différées (chargées à l'accès ou via undefer()) ;
+    # description reste chargée car sérialisée dans TripResponse
     description = Column(Text, nullable=True)          # Description libre
-    special_instructions = Column(Text, nullable=True)  # Instructions spéciales
+    special_instructions = deferred(Column(Text, nullable=True))  # Instructions spéciales
     
-    # Points d'arrêt intermédiaires (JSON ou relation séparée)
-    waypoints = Column(Text, nullable=True)  # JSON des points d'arrêt
+    # Points d'arrêt intermédiaires (JSONB, ex. [{"city": "Bouaké", ...}])
+    waypoints = deferred(Column(JSONB, nullable=True))
     
     # Récurrence (pour trajets réguliers)
     is_recurring = Column(Boolean, default=False, nullable=False)
@@ -91,10 +154,12 @@ class Trip(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), onupdate=func.now(), nullable=True)
     cancelled_at = Column(DateTime(timezone=True), nullable=True)
-    cancellation_reason = Column(String(255), nullable=True)
+    cancellation_reason = deferred(Column(String(255), nullable=True))
     
     # Relations
-    driver = relationship("User", foreign_keys=[driver_id])
+    # lazy="raise" : pas de chargement implicite (N+1) ; charger explicitement via
+    # options(selectinload(Trip.driver).load_only(...)) ou db.get(User, trip.driver_id)
+    driver = relationship("User", foreign_keys=[driver_id], lazy="raise")
     # reservations = relationship("Reservation", back_populates="trip", cascade="all, delete-orphan")
 
     def __repr__(self):
@@ -106,7 +171,40 @@ class Trip(Base):
         return (
             self.status == TripStatus.ACTIVE and
             self.available_seats > 0 and
-            self.departure_datetime > func.now()
+            _is_future(self.departure_datetime)
+        )
+
+    @classmethod
+    def bookable_clause(cls):
+        """Équivalent SQL de is_bookable, pour filtrer côté base"""
+        return and_(
+            # Valeur inlinée dans le SQL : le planificateur peut choisir l'index partiel ix_trips_search
+            cls.status == literal(TripStatus.ACTIVE, type_=cls.status.type, literal_execute=True),
+            cls.available_seats > 0,
+            cls.departure_datetime > func.now()
+        )
+
+    @classmethod
+    def preferences_filter(cls, required: int = 0, forbidden: int = 0):
+        """
+        Expression SQL : bits `required` présents et bits `forbidden` absents
+        Une seule opération AND + comparaison par ligne
+        """
+        return cls.preferences_mask.op("&")(required | forbidden) == required
+
+    @classmethod
+    def departure_near(cls, latitude: float, longitude: float, radius_km: float):
+        """
+        Expression SQL : départ à moins de radius_km du point donné
+        earth_box @> utilise l'index GiST ix_trips_departure_earth, earth_distance affine le cercle
+        """
+        center = func.ll_to_earth(latitude, longitude)
+        departure = func.ll_to_earth(cls.departure_latitude, cls.departure_longitude)
+        radius_m = radius_km * 1000
+        
+        return and_(
+            func.earth_box(center, radius_m).op("@>")(departure),
+            func.earth_distance(center, departure) <= radius_m
         )
 
     @property
@@ -156,23 +254,49 @@ class Trip(Base):
         self.platform_commission = self.total_earnings * commission_rate
         self.driver_earnings = self.total_earnings - self.platform_commission
 
+    @classmethod
+    def recompute_earnings_bulk(cls, db, commission_rate: float = 0.10, where_clause=None) -> int:
+        """
+        Recalcule les gains de nombreux trajets en une seule requête UPDATE
+        Par défaut : tous les trajets terminés. Retourne le nombre de lignes modifiées
+        (le commit reste à la charge de l'appelant)
+        """
+        total = (cls.total_seats - cls.available_seats) * cls.price_per_seat
+        if where_clause is None:
+            where_clause = cls.status == TripStatus.COMPLETED
+        
+        stmt = (
+            update(cls)
+            .where(where_clause)
+            .values(
+                total_earnings=total,
+                platform_commission=total * commission_rate,
+                driver_earnings=total * (1 - commission_rate)
+            )
+            # Pas de synchronisation de la session : les instances chargées restent à expirer
+            .execution_options(synchronize_session=False)
+        )
+        return db.execute(stmt).rowcount
+
     def can_be_modified_by(self, user_id: int) -> bool:
         """Vérifie si un utilisateur peut modifier ce trajet"""
         return (
             self.driver_id == user_id and
-            self.status in [TripStatus.ACTIVE, TripStatus.FULL] and
-            self.departure_datetime > func.now()
+            self.status in (TripStatus.ACTIVE, TripStatus.FULL) and
+            _is_future(self.departure_datetime)
         )
 
     def get_distance_to_point(self, latitude: float, longitude: float) -> float:
         """
-        Calcule la distance entre le point de départ et un point donné
-        (Implémentation basique - à améliorer avec une vraie API de géolocalisation)
+        Calcule la distance (haversine, en km) entre le point de départ et un point donné
+        Pour plusieurs trajets, utiliser haversine_np sur des tableaux de coordonnées
         """
-        if not self.departure_latitude or not self.departure_longitude:
+        if self.departure_latitude is None or self.departure_longitude is None:
             return float('inf')
         
-        # Formule de distance approximative (à remplacer par une vraie API)
-        lat_diff = abs(self.departure_latitude - latitude)
-        lon_diff = abs(self.departure_longitude - longitude)
-        return ((lat_diff ** 2 + lon_diff ** 2) ** 0.5) * 111  # Approximation en km
\ No newline at end of file
+        return haversine_km(self.departure_latitude, self.departure_longitude, latitude, longitude)
+
+
+# ll_to_earth / earth_box proviennent des extensions contrib cube + earthdistance (image postgres standard)
+event.listen(Trip.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS cube"))
+event.listen(Trip.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS earthdistance"))
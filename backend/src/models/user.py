@@ -1,8 +1,9 @@
 """
 Modèle User - Utilisateurs de l'application (passagers et conducteurs)
 """
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Enum, Float
-from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Enum, Float, Index, and_, or_, not_, text
+from sqlalchemy.orm import relationship, declarative_base, deferred
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.sql import func
 import enum
 
@@ -10,6 +11,26 @@ import enum
 Base = declarative_base()
 
 
+def enum_values(enum_cls) -> list:
+    """Valeurs stockées en base pour un enum Python ("active" plutôt que "ACTIVE")"""
+    return [member.value for member in enum_cls]
+
+
+def StringEnum(enum_cls, name: str, length: int = 16) -> Enum:
+    """
+    Enum stocké en VARCHAR + CHECK (pas de type ENUM PostgreSQL)
+    L'ORM continue de renvoyer et valider les membres de l'enum Python
+    """
+    return Enum(
+        enum_cls,
+        name=name,
+        native_enum=False,
+        create_constraint=True,
+        length=length,
+        values_callable=enum_values,
+    )
+
+
 class UserType(str, enum.Enum):
     """Types d'utilisateurs"""
     PASSAGER = "passager"
@@ -25,11 +46,21 @@ class UserStatus(str, enum.Enum):
     BANNED = "banned"       # Banni
 
 
+# Types d'utilisateurs autorisés par rôle (tuples : utilisables en Python et dans IN SQL)
+DRIVER_TYPES = (UserType.CONDUCTEUR, UserType.BOTH)
+PASSENGER_TYPES = (UserType.PASSAGER, UserType.BOTH)
+
+
 class User(Base):
     """
     Modèle utilisateur - Base commune pour passagers et conducteurs
     """
     __tablename__ = "users"
+    __table_args__ = (
+        # Index partiel des comptes actifs (plus petit que l'index unique sur phone)
+        # pour les recherches "phone = :p AND is_active" ; l'unicité reste assurée par phone
+        Index("ix_users_phone_active", "phone", postgresql_where=text("is_active = true")),
+    )
 
     # Identifiants
     id = Column(Integer, primary_key=True, index=True)
@@ -49,8 +80,8 @@ class User(Base):
     is_email_verified = Column(Boolean, default=False, nullable=False)
     
     # Type et statut
-    user_type = Column(Enum(UserType), default=UserType.PASSAGER, nullable=False)
-    status = Column(Enum(UserStatus), default=UserStatus.PENDING, nullable=False)
+    user_type = Column(StringEnum(UserType, "ck_users_user_type"), default=UserType.PASSAGER, nullable=False)
+    status = Column(StringEnum(UserStatus, "ck_users_status"), default=UserStatus.PENDING, nullable=False)
     
     # Localisation
     city = Column(String(100), nullable=True)
@@ -58,7 +89,7 @@ class User(Base):
     
     # Profil
     profile_picture = Column(String(500), nullable=True)  # URL de la photo
-    bio = Column(Text, nullable=True)
+    bio = deferred(Column(Text, nullable=True))  # Différée : absente des réponses de profil
     
     # Évaluations
     rating_average = Column(Float, default=0.0, nullable=False)
@@ -100,22 +131,34 @@ class User(Base):
     def __repr__(self):
         return f"<User(id={self.id}, phone={self.phone}, name={self.first_name} {self.last_name}, type={self.user_type})>"
 
-    @property
+    @hybrid_property
     def full_name(self):
-        """Nom complet de l'utilisateur"""
+        """Nom complet de l'utilisateur (lu directement par les schémas from_attributes)"""
         return f"{self.first_name} {self.last_name}"
 
-    @property
+    @full_name.expression
+    def full_name(cls):
+        return cls.first_name + " " + cls.last_name
+
+    @hybrid_property
     def is_driver(self):
         """Vérifie si l'utilisateur peut être conducteur"""
-        return self.user_type in [UserType.CONDUCTEUR, UserType.BOTH]
+        return self.user_type in DRIVER_TYPES
 
-    @property
+    @is_driver.expression
+    def is_driver(cls):
+        return cls.user_type.in_(DRIVER_TYPES)
+
+    @hybrid_property
     def is_passenger(self):
         """Vérifie si l'utilisateur peut être passager"""
-        return self.user_type in [UserType.PASSAGER, UserType.BOTH]
+        return self.user_type in PASSENGER_TYPES
 
-    @property
+    @is_passenger.expression
+    def is_passenger(cls):
+        return cls.user_type.in_(PASSENGER_TYPES)
+
+    @hybrid_property
     def is_verified(self):
         """Vérifie si l'utilisateur est complètement vérifié"""
         basic_verified = self.is_phone_verified and self.status == UserStatus.VERIFIED
@@ -123,6 +166,14 @@ class User(Base):
             return basic_verified and self.driver_license_verified
         return basic_verified
 
+    @is_verified.expression
+    def is_verified(cls):
+        return and_(
+            cls.is_phone_verified.is_(True),
+            cls.status == UserStatus.VERIFIED,
+            or_(not_(cls.user_type.in_(DRIVER_TYPES)), cls.driver_license_verified.is_(True))
+        )
+
     @property
     def vehicle_info(self):
         """Informations complètes du véhicule"""
@@ -2,21 +2,23 @@
 Routes d'authentification
 Endpoints pour inscription, connexion, vérification OTP, etc.
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from src.database import get_db, get_redis
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database import get_async_db, get_redis
 from src.schemas.auth import (
     UserRegisterRequest, UserLoginRequest, VerifyPhoneRequest,
     ResendOTPRequest, ChangePasswordRequest, ResetPasswordRequest,
     AuthResponse, TokenResponse, UserProfileResponse, MessageResponse,
     OTPSentResponse, DriverVerificationRequest, DriverVerificationResponse
 )
-from src.services.auth import AuthService
+from src.services.auth import AuthService, invalidate_cached_user
+from src.middleware import get_token_payload
 from src.models.user import User, UserType
 
 # Création du router
-router = APIRouter(prefix="/api/v1/auth", tags=["Authentification"])
+router = APIRouter()  # Préfixe et tags définis dans main.py
 
 # Configuration de la sécurité
 security = HTTPBearer()
@@ -30,7 +32,7 @@ def get_auth_service(redis_client=Depends(get_redis)):
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     auth_service: AuthService = Depends(get_auth_service)
 ) -> User:
     """
@@ -38,7 +40,8 @@ async def get_current_user(
     Utilisé dans les endpoints protégés
     """
     token = credentials.credentials
-    return auth_service.get_current_user(db, token)
+    # Payload déjà vérifié par AuthMiddleware (None si le middleware n'est pas monté)
+    return await auth_service.get_current_user(db, token, get_token_payload())
 
 
 async def get_current_verified_user(
@@ -81,7 +84,7 @@ async def get_current_driver(
 @router.post("/register", response_model=MessageResponse, status_code=status.HTTP_201_CREATED)
 async def register(
     user_data: UserRegisterRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     auth_service: AuthService = Depends(get_auth_service)
 ):
     """
@@ -99,11 +102,11 @@ async def register(
     Envoie automatiquement un code OTP de vérification.
     """
     try:
-        # Convertir en dictionnaire
-        user_dict = user_data.dict()
+        # Seuls les champs fournis par le client (les défauts relèvent des colonnes)
+        user_dict = user_data.model_dump(exclude_unset=True, exclude_none=True)
         
         # Créer l'utilisateur
-        new_user = auth_service.register_user(db, user_dict)
+        new_user = await auth_service.register_user(db, user_dict)
         
         return MessageResponse(
             message=f"Compte créé avec succès pour {new_user.phone}. "
@@ -123,7 +126,8 @@ async def register(
 @router.post("/login", response_model=AuthResponse)
 async def login(
     credentials: UserLoginRequest,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
     auth_service: AuthService = Depends(get_auth_service)
 ):
     """
@@ -134,8 +138,12 @@ async def login(
     
     Retourne un token JWT et les informations utilisateur.
     """
-    # Authentifier l'utilisateur
-    user = auth_service.authenticate_user(db, credentials.phone, credentials.password)
+    # Limiter les tentatives (par numéro et IP) avant tout calcul bcrypt
+    client_ip = request.client.host if request.client else "unknown"
+    auth_service.check_login_rate_limit(credentials.phone, client_ip)
+    
+    # Authentifier l'utilisateur (bcrypt hors de la boucle d'événements)
+    user = await auth_service.authenticate_user(db, credentials.phone, credentials.password)
     
     if not user:
         raise HTTPException(
@@ -143,6 +151,8 @@ async def login(
             detail="Numéro de téléphone ou mot de passe incorrect"
         )
     
+    auth_service.reset_login_attempts(credentials.phone, client_ip)
+    
     # Créer le token
     token_data = auth_service.create_token_for_user(user)
     
@@ -150,14 +160,14 @@ async def login(
     return AuthResponse(
         message="Connexion réussie",
         token=TokenResponse(**token_data),
-        user=UserProfileResponse.from_orm(user)
+        user=UserProfileResponse.model_validate(user)
     )
 
 
 @router.post("/verify-phone", response_model=AuthResponse)
 async def verify_phone(
     verification_data: VerifyPhoneRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     auth_service: AuthService = Depends(get_auth_service)
 ):
     """
@@ -169,7 +179,7 @@ async def verify_phone(
     Marque le téléphone comme vérifié et connecte automatiquement l'utilisateur.
     """
     # Vérifier l'OTP et mettre à jour l'utilisateur
-    user = auth_service.verify_phone_number(db, verification_data.phone, verification_data.otp_code)
+    user = await auth_service.verify_phone_number(db, verification_data.phone, verification_data.otp_code)
     
     # Créer le token de connexion automatique
     token_data = auth_service.create_token_for_user(user)
@@ -177,14 +187,14 @@ async def verify_phone(
     return AuthResponse(
         message="Téléphone vérifié avec succès. Vous êtes maintenant connecté.",
         token=TokenResponse(**token_data),
-        user=UserProfileResponse.from_orm(user)
+        user=UserProfileResponse.model_validate(user)
     )
 
 
 @router.post("/resend-otp", response_model=OTPSentResponse)
 async def resend_otp(
     otp_request: ResendOTPRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     auth_service: AuthService = Depends(get_auth_service)
 ):
     """
@@ -193,8 +203,7 @@ async def resend_otp(
     - **phone**: Numéro de téléphone
     """
     # Vérifier que l'utilisateur existe
-    user = db.query(User).filter(User.phone == otp_request.phone).first()
-    if not user:
+    if not await auth_service.user_exists_by_phone(db, otp_request.phone):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Aucun utilisateur trouvé avec ce numéro"
@@ -214,7 +223,7 @@ async def resend_otp(
 async def change_password(
     password_data: ChangePasswordRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     auth_service: AuthService = Depends(get_auth_service)
 ):
     """
@@ -225,7 +234,7 @@ async def change_password(
     
     Nécessite d'être connecté.
     """
-    auth_service.change_password(
+    await auth_service.change_password(
         db, current_user, 
         password_data.current_password, 
         password_data.new_password
@@ -239,7 +248,7 @@ async def change_password(
 @router.post("/reset-password", response_model=MessageResponse)
 async def reset_password(
     reset_data: ResetPasswordRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     auth_service: AuthService = Depends(get_auth_service)
 ):
     """
@@ -251,7 +260,7 @@ async def reset_password(
     
     Utiliser d'abord /forgot-password pour recevoir l'OTP.
     """
-    auth_service.reset_password(
+    await auth_service.reset_password(
         db, reset_data.phone, 
         reset_data.otp_code, 
         reset_data.new_password
@@ -265,7 +274,7 @@ async def reset_password(
 @router.post("/forgot-password", response_model=OTPSentResponse)
 async def forgot_password(
     phone_request: ResendOTPRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     auth_service: AuthService = Depends(get_auth_service)
 ):
     """
@@ -276,8 +285,7 @@ async def forgot_password(
     Envoie un code OTP pour réinitialiser le mot de passe.
     """
     # Vérifier que l'utilisateur existe
-    user = db.query(User).filter(User.phone == phone_request.phone).first()
-    if not user:
+    if not await auth_service.user_exists_by_phone(db, phone_request.phone):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Aucun utilisateur trouvé avec ce numéro"
@@ -297,7 +305,7 @@ async def forgot_password(
 async def request_driver_verification(
     driver_data: DriverVerificationRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Demander la vérification conducteur
@@ -313,25 +321,26 @@ async def request_driver_verification(
     Nécessite d'être connecté. Met à jour le type d'utilisateur pour inclure CONDUCTEUR.
     """
     # Vérifier que l'utilisateur peut devenir conducteur
-    if current_user.user_type == UserType.PASSAGER:
-        current_user.user_type = UserType.BOTH
-    elif current_user.user_type != UserType.CONDUCTEUR and current_user.user_type != UserType.BOTH:
-        current_user.user_type = UserType.BOTH
-    
-    # Mettre à jour les informations du véhicule
-    current_user.driver_license_number = driver_data.driver_license_number
-    current_user.vehicle_make = driver_data.vehicle_make
-    current_user.vehicle_model = driver_data.vehicle_model
-    current_user.vehicle_year = driver_data.vehicle_year
-    current_user.vehicle_color = driver_data.vehicle_color
-    current_user.vehicle_plate = driver_data.vehicle_plate
-    current_user.vehicle_seats = driver_data.vehicle_seats
+    user_type = current_user.user_type
+    if user_type != UserType.CONDUCTEUR and user_type != UserType.BOTH:
+        user_type = UserType.BOTH
     
+    # Mettre à jour le type et les informations du véhicule en un seul UPDATE
     # Dans une vraie application, on marquerait comme "en attente de vérification"
     # Pour le MVP, on l'approuve automatiquement
-    current_user.driver_license_verified = True
+    await db.execute(
+        update(User)
+        .where(User.id == current_user.id)
+        .values(
+            **driver_data.model_dump(),
+            user_type=user_type,
+            driver_license_verified=True
+        )
+    )
     
-    db.commit()
+    await db.commit()
+    # UPDATE en masse : pas d'événement after_update, invalidation explicite du profil en cache
+    await invalidate_cached_user(current_user.id)
     
     return DriverVerificationResponse(
         message="Demande de vérification conducteur soumise avec succès",
@@ -347,7 +356,7 @@ async def get_current_user_profile(current_user: User = Depends(get_current_user
     
     Nécessite d'être connecté avec un token valide.
     """
-    return UserProfileResponse.from_orm(current_user)
+    return UserProfileResponse.model_validate(current_user)
 
 
 @router.post("/logout", response_model=MessageResponse)
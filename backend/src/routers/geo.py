@@ -2,7 +2,13 @@
 Routes pour les services géographiques et cartographiques
 Géocodage, calculs de route, recherche par proximité
 """
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+import asyncio
+import hashlib
+import numpy as np
+from functools import lru_cache
+from itertools import islice
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response
 from sqlalchemy.orm import Session
 from typing import Optional, List
 
@@ -10,65 +16,168 @@ from src.database import get_db
 from src.schemas.geo import (
     GeocodingRequest, RouteCalculationRequest, NearbySearchRequest,
     GeocodingResponse, RouteResponse, NearbyPointsResponse,
-    DistanceCalculationResponse, CoordinatesRequest
+    DistanceCalculationResponse, CoordinatesRequest,
+    DistanceBatchRequest, DistanceBatchResponse,
+    GeocodingBatchRequest, GeocodingBatchResponse,
+    RouteMatrixRequest, RouteMatrixResponse
 )
-from src.services.geo import geo_service, Coordinates
+from src.services.geo import geo_service
 from src.models.user import User
 from src.routers.auth import get_current_user
+from src.utils.serialization import json_bytes
 
 # Création du router
-router = APIRouter(prefix="/api/v1/geo", tags=["Géolocalisation & Cartes"])
+router = APIRouter()  # Préfixe et tags définis dans main.py
+
+# Villes proposées en autocomplétion, minuscules calculées une seule fois
+CITIES = (
+    "Abidjan", "Bouaké", "Yamoussoukro", "Korhogo", "San-Pédro",
+    "Daloa", "Man", "Gagnoa", "Divo", "Anyama", "Abengourou",
+    "Agboville", "Grand-Bassam", "Sassandra", "Bondoukou",
+    "Cocody", "Yopougon", "Marcory", "Koumassi", "Bingerville",
+    "Plateau", "Adjamé", "Treichville", "Port-Bouët", "Abobo"
+)
+_CITIES_LOWER = tuple(city.lower() for city in CITIES)
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _build_bigram_index(names) -> dict:
+    """Index inversé bigramme -> indices des villes qui le contiennent"""
+    index = {}
+    for i, name in enumerate(names):
+        for gram in _bigrams(name):
+            index.setdefault(gram, set()).add(i)
+    return index
+
+
+_CITY_BIGRAMS = _build_bigram_index(_CITIES_LOWER)
+
+
+@lru_cache(maxsize=1024)
+def _match_cities(query_lower: str, limit: int) -> tuple:
+    """
+    Villes contenant la requête (résultat mémorisé : frappes répétées d'autocomplétion)
+    Les candidats sont l'intersection des listes de bigrammes, vérifiés ensuite par sous-chaîne
+    """
+    postings = sorted((_CITY_BIGRAMS.get(gram, set()) for gram in _bigrams(query_lower)), key=len)
+    if not postings:
+        return ()
+    candidates = set.intersection(*postings)
+    matches = (CITIES[i] for i in sorted(candidates) if query_lower in _CITIES_LOWER[i])
+    return tuple(islice(matches, limit))
+
+
+# Limites de la Côte d'Ivoire : contenu immuable, sérialisé une seule fois à l'import
+_BOUNDS_JSON = json_bytes({
+    "country": "Côte d'Ivoire",
+    "bounds": {
+        "north": 10.7,
+        "south": 4.3,
+        "east": -2.5,
+        "west": -8.6
+    },
+    "center": {
+        "latitude": 7.5,
+        "longitude": -5.5
+    },
+    "default_zoom": 7,
+    "major_cities": [
+        {"name": "Abidjan", "lat": 5.3364, "lng": -4.0267},
+        {"name": "Bouaké", "lat": 7.6927, "lng": -5.0298},
+        {"name": "Yamoussoukro", "lat": 6.8205, "lng": -5.2893}
+    ]
+})
+_BOUNDS_ETAG = f'"{hashlib.sha1(_BOUNDS_JSON).hexdigest()}"'
+_BOUNDS_HEADERS = {"Cache-Control": "public, max-age=86400", "ETag": _BOUNDS_ETAG}
 
 
 @router.post("/geocode", response_model=GeocodingResponse)
 async def geocode_address(request: GeocodingRequest):
     """Géocoder une adresse en coordonnées GPS"""
-    try:
-        result = geo_service.geocode_address(request.address, request.city)
-        
-        if not result:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Adresse non trouvée : {request.address}"
-            )
-        
-        return GeocodingResponse.from_geocoding_result(result)
-        
-    except HTTPException:
-        raise
-    except Exception as e:
+    result = geo_service.geocode_address(request.address, request.city)
+    
+    if not result:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors du géocodage : {str(e)}"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Adresse non trouvée : {request.address}"
         )
+    
+    return GeocodingResponse.from_geocoding_result(result)
+
+
+@router.post("/geocode/batch", response_model=GeocodingBatchResponse)
+async def geocode_addresses(request: GeocodingBatchRequest):
+    """
+    Géocoder plusieurs adresses en un appel
+    
+    Les résultats suivent l'ordre de la requête ; null pour une adresse introuvable.
+    Les adresses absentes du cache Redis sont demandées à Nominatim en parallèle (threads).
+    """
+    addresses = [(item.address, item.city) for item in request.addresses]
+    results = await asyncio.to_thread(geo_service.cached_geocodes, addresses)
+    
+    misses = [i for i, result in enumerate(results) if result is None]
+    found = await asyncio.gather(*(
+        asyncio.to_thread(geo_service.geocode_address, *addresses[i])
+        for i in misses
+    ))
+    for i, result in zip(misses, found):
+        results[i] = result
+    
+    return GeocodingBatchResponse(
+        results=[
+            GeocodingResponse.from_geocoding_result(result) if result else None
+            for result in results
+        ],
+        total_found=sum(1 for result in results if result)
+    )
 
 
 @router.post("/calculate-route", response_model=RouteResponse)
 async def calculate_route(request: RouteCalculationRequest):
     """Calculer un itinéraire entre deux points"""
-    try:
-        start = Coordinates(request.start_latitude, request.start_longitude)
-        end = Coordinates(request.end_latitude, request.end_longitude)
-        
-        route = geo_service.calculate_route(start, end)
-        
-        if not route:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Impossible de calculer l'itinéraire"
-            )
-        
-        estimated_price = geo_service.estimate_trip_price(route.distance_km)
-        
-        return RouteResponse.from_route_info(route, estimated_price)
-        
-    except HTTPException:
-        raise
-    except Exception as e:
+    route = geo_service.route_between(
+        request.start_latitude, request.start_longitude,
+        request.end_latitude, request.end_longitude
+    )
+    
+    if not route:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors du calcul d'itinéraire : {str(e)}"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Impossible de calculer l'itinéraire"
         )
+    
+    estimated_price = geo_service.estimate_trip_price(route.distance_km)
+    
+    return RouteResponse.from_route_info(route, estimated_price)
+
+
+@router.post("/routes/matrix", response_model=RouteMatrixResponse)
+async def calculate_route_matrix(request: RouteMatrixRequest):
+    """
+    Calculer plusieurs itinéraires en un appel
+    
+    Les itinéraires absents du cache sont demandés à OSRM en parallèle (threads).
+    """
+    routes = await asyncio.gather(*(
+        asyncio.to_thread(
+            geo_service.route_between,
+            item.start_latitude, item.start_longitude,
+            item.end_latitude, item.end_longitude
+        )
+        for item in request.routes
+    ))
+    
+    return RouteMatrixResponse(
+        routes=[
+            RouteResponse.from_route_info(route, geo_service.estimate_trip_price(route.distance_km))
+            for route in routes
+        ],
+        total=len(routes)
+    )
 
 
 @router.get("/cities/search")
@@ -77,31 +186,38 @@ async def search_cities(
     limit: int = Query(10, ge=1, le=50, description="Nombre max de résultats")
 ):
     """Rechercher des villes en Côte d'Ivoire"""
-    try:
-        cities = [
-            "Abidjan", "Bouaké", "Yamoussoukro", "Korhogo", "San-Pédro",
-            "Daloa", "Man", "Gagnoa", "Divo", "Anyama", "Abengourou",
-            "Agboville", "Grand-Bassam", "Sassandra", "Bondoukou",
-            "Cocody", "Yopougon", "Marcory", "Koumassi", "Bingerville",
-            "Plateau", "Adjamé", "Treichville", "Port-Bouët", "Abobo"
-        ]
-        
-        filtered_cities = [
-            city for city in cities 
-            if q.lower() in city.lower()
-        ][:limit]
-        
-        return {
+    filtered_cities = _match_cities(q.lower(), limit)
+    
+    return Response(
+        content=json_bytes({
             "cities": filtered_cities,
             "total_found": len(filtered_cities),
             "query": q
-        }
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la recherche : {str(e)}"
-        )
+        }),
+        media_type="application/json"
+    )
+
+
+@router.websocket("/cities/search/ws")
+async def search_cities_ws(websocket: WebSocket):
+    """
+    Autocomplétion des villes sur une connexion persistante
+    
+    Chaque message texte reçu est une requête ; la réponse a le même format que GET /cities/search.
+    """
+    await websocket.accept()
+    try:
+        while True:
+            q = await websocket.receive_text()
+            filtered_cities = _match_cities(q.lower(), 10) if len(q) >= 2 else ()
+            # Trame texte : directement exploitable par JSON.parse côté navigateur
+            await websocket.send_text(json_bytes({
+                "cities": filtered_cities,
+                "total_found": len(filtered_cities),
+                "query": q
+            }).decode("utf-8"))
+    except WebSocketDisconnect:
+        pass
 
 
 @router.get("/distance")
@@ -112,48 +228,45 @@ async def calculate_distance(
     lng2: float = Query(..., ge=-180, le=180)
 ):
     """Calculer la distance entre deux points"""
-    try:
-        coord1 = Coordinates(lat1, lng1)
-        coord2 = Coordinates(lat2, lng2)
-        
-        distance = geo_service.calculate_distance(coord1, coord2)
-        estimated_duration = int(distance * 1.5)
-        estimated_price = geo_service.estimate_trip_price(distance)
-        
-        return {
-            "start": {"latitude": lat1, "longitude": lng1},
-            "end": {"latitude": lat2, "longitude": lng2},
-            "distance_km": distance,
-            "estimated_duration_minutes": estimated_duration,
-            "estimated_price": estimated_price
-        }
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors du calcul : {str(e)}"
-        )
+    distance = geo_service.distance_km(lat1, lng1, lat2, lng2)
+    estimated_duration = int(distance * 1.5)
+    estimated_price = geo_service.estimate_trip_price(distance)
+    
+    return {
+        "start": {"latitude": lat1, "longitude": lng1},
+        "end": {"latitude": lat2, "longitude": lng2},
+        "distance_km": distance,
+        "estimated_duration_minutes": estimated_duration,
+        "estimated_price": estimated_price
+    }
+
+
+@router.post("/distance/batch", response_model=DistanceBatchResponse)
+async def calculate_distances_batch(request: DistanceBatchRequest):
+    """
+    Calculer plusieurs distances en un appel (vectorisé)
+    
+    Les quatre tableaux décrivent des paires (lat1[i], lng1[i]) → (lat2[i], lng2[i]).
+    Pour une seule paire, préférer GET /distance.
+    """
+    distances = geo_service.calculate_distances(
+        request.lat1, request.lng1, request.lat2, request.lng2
+    )
+    
+    # Durées et prix calculés dans la même passe NumPy (mêmes règles que GET /distance)
+    response = DistanceBatchResponse(
+        distances_km=distances.tolist(),
+        estimated_durations_minutes=(distances * 1.5).astype(np.int64).tolist(),
+        estimated_prices=geo_service.estimate_trip_prices(distances).tolist(),
+        total=len(distances)
+    )
+    
+    return Response(content=response.model_dump_json(), media_type="application/json")
 
 
 @router.get("/ivory-coast/bounds")
-async def get_ivory_coast_bounds():
+async def get_ivory_coast_bounds(request: Request):
     """Récupérer les limites géographiques de la Côte d'Ivoire"""
-    return {
-        "country": "Côte d'Ivoire",
-        "bounds": {
-            "north": 10.7,
-            "south": 4.3,
-            "east": -2.5,
-            "west": -8.6
-        },
-        "center": {
-            "latitude": 7.5,
-            "longitude": -5.5
-        },
-        "default_zoom": 7,
-        "major_cities": [
-            {"name": "Abidjan", "lat": 5.3364, "lng": -4.0267},
-            {"name": "Bouaké", "lat": 7.6927, "lng": -5.0298},
-            {"name": "Yamoussoukro", "lat": 6.8205, "lng": -5.2893}
-        ]
-    }
\ No newline at end of file
+    if request.headers.get("if-none-match") == _BOUNDS_ETAG:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_BOUNDS_HEADERS)
+    return Response(content=_BOUNDS_JSON, media_type="application/json", headers=_BOUNDS_HEADERS)
\ No newline at end of file
@@ -2,7 +2,8 @@
 Routes pour la gestion des réservations
 Endpoints CRUD pour les réservations de trajets
 """
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, status, Query
+from fastapi.responses import Response
 from sqlalchemy.orm import Session
 from typing import Optional
 import math
@@ -12,7 +13,8 @@ from src.schemas.reservation import (
     ReservationCreateRequest, ReservationUpdateRequest, ReservationCancelRequest,
     ReservationConfirmRequest, RatingRequest, ReservationResponse,
     ReservationListResponse, ReservationCreateResponse, ReservationConfirmResponse,
-    MyReservationsResponse, TripReservationsResponse, ReservationStatsResponse
+    MyReservationsResponse, TripReservationsResponse, ReservationStatsResponse,
+    reservation_list_adapter
 )
 from src.schemas.auth import MessageResponse
 from src.services.reservation import ReservationService
@@ -20,7 +22,7 @@ from src.models.user import User
 from src.routers.auth import get_current_user, get_current_verified_user, get_current_driver
 
 # Création du router
-router = APIRouter(prefix="/api/v1/reservations", tags=["Réservations"])
+router = APIRouter()  # Préfixe et tags définis dans main.py
 
 
 @router.post("/", response_model=ReservationCreateResponse, status_code=status.HTTP_201_CREATED)
@@ -41,32 +43,24 @@ async def create_reservation(
     
     Nécessite d'être un utilisateur vérifié (téléphone confirmé).
     """
-    try:
-        # Convertir en dictionnaire
-        reservation_dict = reservation_data.dict()
-        trip_id = reservation_dict.pop("trip_id")
-        
-        # Créer la réservation
-        new_reservation = ReservationService.create_reservation(
-            db, reservation_dict, current_passenger, trip_id
-        )
-        
-        return ReservationCreateResponse(
-            message=f"Réservation créée avec succès ! {new_reservation.number_of_seats} place(s) réservée(s).",
-            reservation=ReservationResponse.from_orm(new_reservation)
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la réservation: {str(e)}"
-        )
+    # Convertir en dictionnaire (trip_id exclu directement par pydantic-core)
+    reservation_dict = reservation_data.model_dump(exclude={"trip_id"})
+    
+    # Créer la réservation
+    new_reservation = ReservationService.create_reservation(
+        db, reservation_dict, current_passenger, reservation_data.trip_id
+    )
+    
+    return ReservationCreateResponse(
+        message=f"Réservation créée avec succès ! {new_reservation.number_of_seats} place(s) réservée(s).",
+        reservation=ReservationResponse.model_validate(new_reservation)
+    )
 
 
 @router.get("/my", response_model=MyReservationsResponse)
 async def get_my_reservations(
+    limit: int = Query(20, ge=1, le=100, description="Réservations par catégorie"),
+    offset: int = Query(0, ge=0, description="Décalage dans chaque catégorie"),
     db: Session = Depends(get_db),
     current_passenger: User = Depends(get_current_verified_user)
 ):
@@ -80,57 +74,30 @@ async def get_my_reservations(
     
     Inclut des statistiques globales.
     """
-    try:
-        # Récupérer les réservations
-        reservations_data = ReservationService.get_my_reservations(db, current_passenger)
-        
-        # Calculer les statistiques
-        total_reservations = (
-            len(reservations_data["active_reservations"]) +
-            len(reservations_data["completed_reservations"]) +
-            len(reservations_data["cancelled_reservations"])
-        )
-        
-        total_spent = sum(
-            reservation.total_price 
-            for reservation in reservations_data["completed_reservations"]
-        )
-        
-        total_trips = len(reservations_data["completed_reservations"])
-        
-        # Calculer la note moyenne donnée
-        ratings = [
-            r.driver_rating for r in reservations_data["completed_reservations"]
-            if r.driver_rating is not None
-        ]
-        average_rating_given = sum(ratings) / len(ratings) if ratings else 0.0
-        
-        return MyReservationsResponse(
-            active_reservations=[
-                ReservationResponse.from_orm(r) 
-                for r in reservations_data["active_reservations"]
-            ],
-            completed_reservations=[
-                ReservationResponse.from_orm(r) 
-                for r in reservations_data["completed_reservations"]
-            ],
-            cancelled_reservations=[
-                ReservationResponse.from_orm(r) 
-                for r in reservations_data["cancelled_reservations"]
-            ],
-            total_reservations=total_reservations,
-            total_spent=total_spent,
-            total_trips=total_trips,
-            average_rating_given=average_rating_given
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la récupération: {str(e)}"
-        )
+    # Récupérer les réservations
+    reservations_data = ReservationService.get_my_reservations(db, current_passenger, limit, offset)
+    
+    # Statistiques sur tout l'historique, agrégées en SQL (les listes sont tronquées)
+    stats = ReservationService.get_reservation_stats(db, current_passenger.id)
+    
+    response = MyReservationsResponse(
+        active_reservations=reservation_list_adapter.validate_python(
+            reservations_data.active, from_attributes=True
+        ),
+        completed_reservations=reservation_list_adapter.validate_python(
+            reservations_data.completed, from_attributes=True
+        ),
+        cancelled_reservations=reservation_list_adapter.validate_python(
+            reservations_data.cancelled, from_attributes=True
+        ),
+        total_reservations=stats["total"],
+        total_spent=stats["completed_amount"],
+        total_trips=stats["completed"],
+        average_rating_given=stats["average_driver_rating"] or 0.0
+    )
+    
+    # Sérialisation directe par pydantic-core (évite la revalidation + jsonable_encoder)
+    return Response(content=response.model_dump_json(), media_type="application/json")
 
 
 @router.get("/{reservation_id}", response_model=ReservationResponse)
@@ -146,17 +113,8 @@ async def get_reservation_details(
     
     Accessible au passager et au conducteur concernés.
     """
-    try:
-        reservation = ReservationService.get_reservation_by_id(db, reservation_id, current_user)
-        return ReservationResponse.from_orm(reservation)
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la récupération: {str(e)}"
-        )
+    reservation = ReservationService.get_reservation_by_id(db, reservation_id, current_user)
+    return ReservationResponse.model_validate(reservation)
 
 
 @router.put("/{reservation_id}", response_model=ReservationResponse)
@@ -179,34 +137,13 @@ async def update_reservation(
     - Seul le passager peut modifier
     - Impossible de modifier une réservation confirmée
     """
-    try:
-        reservation = ReservationService.get_reservation_by_id(db, reservation_id, current_user)
-        
-        # Vérifier que c'est le passager
-        if reservation.passenger_id != current_user.id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Seul le passager peut modifier cette réservation"
-            )
-        
-        # Mettre à jour les champs modifiables
-        update_dict = update_data.dict(exclude_unset=True)
-        for field, value in update_dict.items():
-            if hasattr(reservation, field):
-                setattr(reservation, field, value)
-        
-        db.commit()
-        db.refresh(reservation)
-        
-        return ReservationResponse.from_orm(reservation)
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la modification: {str(e)}"
-        )
+    reservation = ReservationService.update_reservation(
+        db, reservation_id, current_user, update_data.model_dump(exclude_unset=True)
+    )
+    response = ReservationResponse.model_validate(reservation)
+    db.commit()
+    
+    return response
 
 
 @router.post("/{reservation_id}/confirm", response_model=ReservationConfirmResponse)
@@ -225,29 +162,20 @@ async def confirm_reservation(
     
     Seul le conducteur du trajet peut confirmer/refuser.
     """
-    try:
-        confirmed_reservation = ReservationService.confirm_reservation(
-            db, reservation_id, current_driver, 
-            confirm_data.accept, confirm_data.message
-        )
-        
-        if confirm_data.accept:
-            message = "Réservation confirmée avec succès ! Le passager a été notifié."
-        else:
-            message = "Réservation refusée. Le passager a été notifié."
-        
-        return ReservationConfirmResponse(
-            message=message,
-            reservation=ReservationResponse.from_orm(confirmed_reservation)
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la confirmation: {str(e)}"
-        )
+    confirmed_reservation = ReservationService.confirm_reservation(
+        db, reservation_id, current_driver, 
+        confirm_data.accept, confirm_data.message
+    )
+    
+    if confirm_data.accept:
+        message = "Réservation confirmée avec succès ! Le passager a été notifié."
+    else:
+        message = "Réservation refusée. Le passager a été notifié."
+    
+    return ReservationConfirmResponse(
+        message=message,
+        reservation=ReservationResponse.model_validate(confirmed_reservation)
+    )
 
 
 @router.delete("/{reservation_id}", response_model=MessageResponse)
@@ -266,28 +194,19 @@ async def cancel_reservation(
     Accessible au passager et au conducteur concernés.
     Les places sont automatiquement libérées.
     """
-    try:
-        cancelled_reservation = ReservationService.cancel_reservation(
-            db, reservation_id, current_user, cancel_data.reason
-        )
-        
-        if cancelled_reservation.passenger_id == current_user.id:
-            message = "Votre réservation a été annulée avec succès. Le conducteur a été notifié."
-        else:
-            message = "Réservation annulée. Le passager a été notifié et sera remboursé si nécessaire."
-        
-        return MessageResponse(
-            message=message,
-            success=True
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de l'annulation: {str(e)}"
-        )
+    cancelled_reservation = ReservationService.cancel_reservation(
+        db, reservation_id, current_user, cancel_data.reason
+    )
+    
+    if cancelled_reservation.passenger_id == current_user.id:
+        message = "Votre réservation a été annulée avec succès. Le conducteur a été notifié."
+    else:
+        message = "Réservation annulée. Le passager a été notifié et sera remboursé si nécessaire."
+    
+    return MessageResponse(
+        message=message,
+        success=True
+    )
 
 
 @router.post("/{reservation_id}/start", response_model=MessageResponse)
@@ -304,23 +223,14 @@ async def start_reservation(
     Accessible au passager et au conducteur.
     Marque le début effectif du trajet.
     """
-    try:
-        started_reservation = ReservationService.mark_reservation_as_started(
-            db, reservation_id, current_user
-        )
-        
-        return MessageResponse(
-            message="Trajet commencé ! Bon voyage et arrivée en toute sécurité.",
-            success=True
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors du démarrage: {str(e)}"
-        )
+    started_reservation = ReservationService.mark_reservation_as_started(
+        db, reservation_id, current_user
+    )
+    
+    return MessageResponse(
+        message="Trajet commencé ! Bon voyage et arrivée en toute sécurité.",
+        success=True
+    )
 
 
 @router.post("/{reservation_id}/complete", response_model=MessageResponse)
@@ -337,23 +247,14 @@ async def complete_reservation(
     Accessible au passager et au conducteur.
     Finalise le trajet et permet les évaluations.
     """
-    try:
-        completed_reservation = ReservationService.mark_reservation_as_completed(
-            db, reservation_id, current_user
-        )
-        
-        return MessageResponse(
-            message="Trajet terminé avec succès ! Vous pouvez maintenant évaluer votre expérience.",
-            success=True
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la finalisation: {str(e)}"
-        )
+    completed_reservation = ReservationService.mark_reservation_as_completed(
+        db, reservation_id, current_user
+    )
+    
+    return MessageResponse(
+        message="Trajet terminé avec succès ! Vous pouvez maintenant évaluer votre expérience.",
+        success=True
+    )
 
 
 @router.post("/{reservation_id}/rate", response_model=MessageResponse)
@@ -375,29 +276,20 @@ async def rate_trip(
     
     Uniquement possible après completion du trajet.
     """
-    try:
-        rated_reservation = ReservationService.rate_trip(
-            db, reservation_id, current_user, 
-            rating_data.rating, rating_data.comment
-        )
-        
-        if rated_reservation.passenger_id == current_user.id:
-            message = f"Merci d'avoir noté le conducteur ({rating_data.rating}/5) !"
-        else:
-            message = f"Merci d'avoir noté le passager ({rating_data.rating}/5) !"
-        
-        return MessageResponse(
-            message=message,
-            success=True
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de l'évaluation: {str(e)}"
-        )
+    rated_reservation = ReservationService.rate_trip(
+        db, reservation_id, current_user, 
+        rating_data.rating, rating_data.comment
+    )
+    
+    if rated_reservation.passenger_id == current_user.id:
+        message = f"Merci d'avoir noté le conducteur ({rating_data.rating}/5) !"
+    else:
+        message = f"Merci d'avoir noté le passager ({rating_data.rating}/5) !"
+    
+    return MessageResponse(
+        message=message,
+        success=True
+    )
 
 
 # Endpoints pour les conducteurs
@@ -405,11 +297,13 @@ async def rate_trip(
 @router.get("/trip/{trip_id}", response_model=TripReservationsResponse)
 async def get_trip_reservations(
     trip_id: int,
+    limit: int = Query(20, ge=1, le=100, description="Réservations par catégorie"),
+    offset: int = Query(0, ge=0, description="Décalage dans chaque catégorie"),
     db: Session = Depends(get_db),
     current_driver: User = Depends(get_current_driver)
 ):
     """
-    Récupérer toutes les réservations d'un trajet (conducteur uniquement)
+    Récupérer les réservations d'un trajet (conducteur uniquement), paginées par catégorie
     
     - **trip_id**: ID du trajet
     
@@ -420,51 +314,31 @@ async def get_trip_reservations(
     
     Accessible uniquement au conducteur propriétaire du trajet.
     """
-    try:
-        reservations_data = ReservationService.get_trip_reservations(db, trip_id, current_driver)
-        
-        # Calculer les statistiques
-        total_reservations = (
-            len(reservations_data["pending_reservations"]) +
-            len(reservations_data["confirmed_reservations"]) +
-            len(reservations_data["cancelled_reservations"])
-        )
-        
-        confirmed_passengers = sum(
-            r.number_of_seats for r in reservations_data["confirmed_reservations"]
-        )
-        
-        total_earnings = sum(
-            r.total_price for r in reservations_data["confirmed_reservations"]
-        )
-        
-        return TripReservationsResponse(
-            trip_id=trip_id,
-            trip_summary=f"Trajet #{trip_id}",
-            pending_reservations=[
-                ReservationResponse.from_orm(r) 
-                for r in reservations_data["pending_reservations"]
-            ],
-            confirmed_reservations=[
-                ReservationResponse.from_orm(r) 
-                for r in reservations_data["confirmed_reservations"]
-            ],
-            cancelled_reservations=[
-                ReservationResponse.from_orm(r) 
-                for r in reservations_data["cancelled_reservations"]
-            ],
-            total_reservations=total_reservations,
-            confirmed_passengers=confirmed_passengers,
-            total_earnings=total_earnings
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la récupération: {str(e)}"
-        )
+    reservations_data = ReservationService.get_trip_reservations(
+        db, trip_id, current_driver, limit, offset
+    )
+    
+    # Totaux sur toutes les réservations du trajet (les listes ne sont qu'une page)
+    totals = ReservationService.get_trip_reservation_totals(db, trip_id)
+    
+    response = TripReservationsResponse(
+        trip_id=trip_id,
+        trip_summary=f"Trajet #{trip_id}",
+        pending_reservations=reservation_list_adapter.validate_python(
+            reservations_data.pending, from_attributes=True
+        ),
+        confirmed_reservations=reservation_list_adapter.validate_python(
+            reservations_data.confirmed, from_attributes=True
+        ),
+        cancelled_reservations=reservation_list_adapter.validate_python(
+            reservations_data.cancelled, from_attributes=True
+        ),
+        total_reservations=totals["total"],
+        confirmed_passengers=totals["confirmed_passengers"],
+        total_earnings=totals["confirmed_amount"]
+    )
+    
+    return Response(content=response.model_dump_json(), media_type="application/json")
 
 
 @router.get("/stats", response_model=ReservationStatsResponse)
@@ -478,40 +352,18 @@ async def get_reservation_stats(
     Pour les passagers : leurs statistiques de réservation
     Pour les conducteurs : statistiques de leurs trajets
     """
-    try:
-        if current_user.is_driver:
-            # Stats pour conducteur (à implémenter)
-            return ReservationStatsResponse(
-                total_reservations=0,
-                pending_count=0,
-                confirmed_count=0,
-                completed_count=0,
-                cancelled_count=0,
-                total_revenue=0.0,
-                average_rating=current_user.rating_average
-            )
-        else:
-            # Stats pour passager
-            reservations_data = ReservationService.get_my_reservations(db, current_user)
-            
-            total_reservations = (
-                len(reservations_data["active_reservations"]) +
-                len(reservations_data["completed_reservations"]) +
-                len(reservations_data["cancelled_reservations"])
-            )
-            
-            return ReservationStatsResponse(
-                total_reservations=total_reservations,
-                pending_count=len([r for r in reservations_data["active_reservations"] if r.status.value == "pending"]),
-                confirmed_count=len([r for r in reservations_data["active_reservations"] if r.status.value in ["confirmed", "paid"]]),
-                completed_count=len(reservations_data["completed_reservations"]),
-                cancelled_count=len(reservations_data["cancelled_reservations"]),
-                total_revenue=0.0,  # Pour passager
-                average_rating=current_user.rating_average
-            )
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la récupération des statistiques: {str(e)}"
-        )
+    # Une seule requête d'agrégation (conducteur : réservations de ses trajets)
+    stats = ReservationService.get_reservation_stats(
+        db, current_user.id, as_driver=current_user.is_driver
+    )
+    
+    return ReservationStatsResponse(
+        total_reservations=stats["total"],
+        pending_count=stats["pending"],
+        confirmed_count=stats["confirmed"],
+        completed_count=stats["completed"],
+        cancelled_count=stats["cancelled"],
+        # Revenus : trajets terminés pour un conducteur, aucun pour un passager
+        total_revenue=stats["completed_amount"] if current_user.is_driver else 0.0,
+        average_rating=current_user.rating_average
+    )
@@ -2,30 +2,33 @@
 Routes pour la gestion des trajets
 Endpoints CRUD pour les trajets de covoiturage
 """
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, status, Query
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
-import math
+import json
 
-from src.database import get_db
+from src.database import get_async_db
 from src.schemas.trip import (
     TripCreateRequest, TripUpdateRequest, TripSearchFilters,
     TripResponse, TripListResponse, TripCreateResponse,
-    TripStatsResponse, MyTripsResponse, TripCancelRequest
+    TripStatsResponse, MyTripsResponse, TripCancelRequest, trip_list_adapter
 )
 from src.schemas.auth import MessageResponse
-from src.services.trip import TripService
+from src.services.trip import (
+    TripService, encode_trip_cursor, notify_trip_passengers, RIDE_NOTIFIED_STATUSES
+)
 from src.models.user import User
 from src.routers.auth import get_current_user, get_current_driver
 
 # Création du router
-router = APIRouter(prefix="/api/v1/trips", tags=["Trajets"])
+router = APIRouter()  # Préfixe et tags définis dans main.py
 
 
 @router.post("/", response_model=TripCreateResponse, status_code=status.HTTP_201_CREATED)
 async def create_trip(
     trip_data: TripCreateRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_driver: User = Depends(get_current_driver)
 ):
     """
@@ -45,25 +48,13 @@ async def create_trip(
     
     Nécessite d'être un conducteur vérifié.
     """
-    try:
-        # Convertir en dictionnaire
-        trip_dict = trip_data.dict()
-        
-        # Créer le trajet
-        new_trip = TripService.create_trip(db, trip_dict, current_driver)
-        
-        return TripCreateResponse(
-            message=f"Trajet créé avec succès ! {new_trip.route_summary}",
-            trip=TripResponse.from_orm(new_trip)
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la création du trajet: {str(e)}"
-        )
+    # Créer le trajet
+    new_trip = await TripService.create_trip(db, trip_data, current_driver)
+    
+    return TripCreateResponse(
+        message=f"Trajet créé avec succès ! {new_trip.route_summary}",
+        trip=TripResponse.model_validate(new_trip)
+    )
 
 
 @router.get("/", response_model=TripListResponse)
@@ -79,7 +70,8 @@ async def search_trips(
     radius_km: Optional[float] = Query(10, description="Rayon de recherche en km", ge=1, le=100),
     page: int = Query(1, description="Numéro de page", ge=1),
     per_page: int = Query(20, description="Trajets par page", ge=1, le=100),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="Curseur next_cursor de la page précédente (remplace page)"),
+    db: AsyncSession = Depends(get_async_db),
     current_user: Optional[User] = Depends(get_current_user)
 ):
     """
@@ -94,53 +86,55 @@ async def search_trips(
     - Localisation géographique
     
     Retourne une liste paginée des trajets correspondants.
+    Pour parcourir de nombreuses pages, préférer `cursor` (next_cursor) à `page` :
+    total_count compte alors les trajets restants à partir du curseur.
     """
-    try:
-        # Créer les filtres
-        filters = TripSearchFilters(
-            departure_city=departure_city,
-            arrival_city=arrival_city,
-            departure_date=departure_date,
-            min_seats=min_seats,
-            max_price=max_price,
-            accepts_pets=accepts_pets,
-            latitude=latitude,
-            longitude=longitude,
-            radius_km=radius_km,
-            page=page,
-            per_page=per_page
-        )
-        
-        # Rechercher les trajets
-        trips, total_count = TripService.search_trips(db, filters, current_user)
-        
-        # Calculs de pagination
-        total_pages = math.ceil(total_count / per_page)
+    # Créer les filtres
+    filters = TripSearchFilters(
+        departure_city=departure_city,
+        arrival_city=arrival_city,
+        departure_date=departure_date,
+        min_seats=min_seats,
+        max_price=max_price,
+        accepts_pets=accepts_pets,
+        latitude=latitude,
+        longitude=longitude,
+        radius_km=radius_km,
+        page=page,
+        per_page=per_page,
+        cursor=cursor
+    )
+    
+    # Rechercher les trajets
+    trips, total_count = await TripService.search_trips(db, filters, current_user)
+    
+    # Calculs de pagination
+    total_pages = (total_count + per_page - 1) // per_page  # Division entière arrondie au supérieur
+    if cursor:
+        has_next = len(trips) < total_count
+        has_prev = True
+    else:
         has_next = page < total_pages
         has_prev = page > 1
-        
-        return TripListResponse(
-            trips=[TripResponse.from_orm(trip) for trip in trips],
-            total_count=total_count,
-            page=page,
-            per_page=per_page,
-            total_pages=total_pages,
-            has_next=has_next,
-            has_prev=has_prev
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la recherche: {str(e)}"
-        )
+    
+    response = TripListResponse(
+        trips=trip_list_adapter.validate_python(trips, from_attributes=True),
+        total_count=total_count,
+        page=page,
+        per_page=per_page,
+        total_pages=total_pages,
+        has_next=has_next,
+        has_prev=has_prev,
+        next_cursor=encode_trip_cursor(trips[-1]) if has_next and trips else None
+    )
+    
+    # Sérialisation directe par pydantic-core (évite la revalidation + jsonable_encoder)
+    return Response(content=response.model_dump_json(), media_type="application/json")
 
 
 @router.get("/my", response_model=MyTripsResponse)
 async def get_my_trips(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_driver: User = Depends(get_current_driver)
 ):
     """
@@ -153,48 +147,26 @@ async def get_my_trips(
     
     Inclut des statistiques globales.
     """
-    try:
-        # Récupérer les trajets
-        trips_data = TripService.get_my_trips(db, current_driver)
-        
-        # Calculer les statistiques
-        total_trips = (
-            len(trips_data["active_trips"]) + 
-            len(trips_data["completed_trips"]) + 
-            len(trips_data["cancelled_trips"])
-        )
-        
-        total_earnings = sum(trip.driver_earnings for trip in trips_data["completed_trips"])
-        
-        # Calculer le nombre total de passagers transportés
-        total_passengers = sum(
-            (trip.total_seats - trip.available_seats) 
-            for trip in trips_data["completed_trips"]
-        )
-        
-        return MyTripsResponse(
-            active_trips=[TripResponse.from_orm(trip) for trip in trips_data["active_trips"]],
-            completed_trips=[TripResponse.from_orm(trip) for trip in trips_data["completed_trips"]],
-            cancelled_trips=[TripResponse.from_orm(trip) for trip in trips_data["cancelled_trips"]],
-            total_trips=total_trips,
-            total_earnings=total_earnings,
-            total_passengers=total_passengers,
-            average_rating=current_driver.rating_average
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la récupération: {str(e)}"
-        )
+    # Récupérer les trajets et les totaux calculés en SQL
+    trips_data = await TripService.get_my_trips(db, current_driver)
+    
+    response = MyTripsResponse(
+        active_trips=trip_list_adapter.validate_python(trips_data["active_trips"], from_attributes=True),
+        completed_trips=trip_list_adapter.validate_python(trips_data["completed_trips"], from_attributes=True),
+        cancelled_trips=trip_list_adapter.validate_python(trips_data["cancelled_trips"], from_attributes=True),
+        total_trips=trips_data["total_trips"],
+        total_earnings=trips_data["total_earnings"],
+        total_passengers=trips_data["total_passengers"],
+        average_rating=current_driver.rating_average
+    )
+    
+    return Response(content=response.model_dump_json(), media_type="application/json")
 
 
 @router.get("/{trip_id}", response_model=TripResponse)
 async def get_trip_details(
     trip_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: Optional[User] = Depends(get_current_user)
 ):
     """
@@ -205,24 +177,15 @@ async def get_trip_details(
     Accessible à tous les utilisateurs connectés.
     Affiche toutes les informations du trajet et du conducteur.
     """
-    try:
-        trip = TripService.get_trip_by_id(db, trip_id, current_user)
-        return TripResponse.from_orm(trip)
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la récupération: {str(e)}"
-        )
+    trip = await TripService.get_trip_by_id(db, trip_id, current_user)
+    return TripResponse.model_validate(trip)
 
 
 @router.put("/{trip_id}", response_model=TripResponse)
 async def update_trip(
     trip_id: int,
     update_data: TripUpdateRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_driver: User = Depends(get_current_driver)
 ):
     """
@@ -241,29 +204,18 @@ async def update_trip(
     - Impossible de modifier moins de 2h avant le départ
     - Seul le conducteur propriétaire peut modifier
     """
-    try:
-        # Convertir en dictionnaire (exclure les None)
-        update_dict = update_data.dict(exclude_unset=True)
-        
-        # Mettre à jour le trajet
-        updated_trip = TripService.update_trip(db, trip_id, update_dict, current_driver)
-        
-        return TripResponse.from_orm(updated_trip)
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la modification: {str(e)}"
-        )
+    # Mettre à jour le trajet
+    updated_trip = await TripService.update_trip(db, trip_id, update_data, current_driver)
+    
+    return TripResponse.model_validate(updated_trip)
 
 
 @router.delete("/{trip_id}", response_model=MessageResponse)
 async def cancel_trip(
     trip_id: int,
     cancel_data: TripCancelRequest,
-    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db),
     current_driver: User = Depends(get_current_driver)
 ):
     """
@@ -273,34 +225,35 @@ async def cancel_trip(
     - **reason**: Raison de l'annulation (obligatoire)
     - **notify_passengers**: Notifier les passagers (par défaut: true)
     
-    Les passagers ayant réservé seront automatiquement notifiés.
+    Les passagers ayant réservé seront notifiés après l'envoi de la réponse.
     Les remboursements seront traités selon la politique d'annulation.
     """
-    try:
-        # Annuler le trajet
-        cancelled_trip = TripService.cancel_trip(
-            db, trip_id, current_driver, cancel_data.reason
-        )
-        
-        return MessageResponse(
-            message=f"Trajet {cancelled_trip.route_summary} annulé avec succès. "
-                   f"Les passagers ont été notifiés.",
-            success=True
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de l'annulation: {str(e)}"
-        )
+    # Annuler le trajet
+    cancelled_trip = await TripService.cancel_trip(
+        db, trip_id, current_driver, cancel_data.reason
+    )
+    route = cancelled_trip.route_summary
+    
+    if not cancel_data.notify_passengers:
+        return MessageResponse(message=f"Trajet {route} annulé avec succès.", success=True)
+    
+    # Envoi des notifications hors du chemin de la requête
+    background_tasks.add_task(
+        notify_trip_passengers, cancelled_trip.id,
+        f"Votre trajet {route} a été annulé par le conducteur : {cancel_data.reason}"
+    )
+    
+    return MessageResponse(
+        message=f"Trajet {route} annulé avec succès. "
+               f"Les passagers vont être notifiés.",
+        success=True
+    )
 
 
 @router.get("/{trip_id}/stats", response_model=TripStatsResponse)
 async def get_trip_stats(
     trip_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_driver: User = Depends(get_current_driver)
 ):
     """
@@ -314,23 +267,15 @@ async def get_trip_stats(
     - Commission de la plateforme
     - Détails financiers
     """
-    try:
-        stats = TripService.get_trip_stats(db, trip_id, current_driver)
-        return TripStatsResponse(**stats)
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la récupération des statistiques: {str(e)}"
-        )
+    stats = await TripService.get_trip_stats(db, trip_id, current_driver)
+    return TripStatsResponse(**stats)
 
 
 @router.post("/{trip_id}/start", response_model=MessageResponse)
 async def start_trip(
     trip_id: int,
-    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db),
     current_driver: User = Depends(get_current_driver)
 ):
     """
@@ -341,28 +286,25 @@ async def start_trip(
     Marque le trajet comme "en cours" et enregistre l'heure de départ réelle.
     Les passagers seront notifiés que le trajet a commencé.
     """
-    try:
-        started_trip = TripService.mark_trip_as_started(db, trip_id, current_driver)
-        
-        return MessageResponse(
-            message=f"Trajet {started_trip.route_summary} démarré avec succès ! "
-                   f"Bon voyage et conduisez prudemment.",
-            success=True
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors du démarrage: {str(e)}"
-        )
+    started_trip = await TripService.mark_trip_as_started(db, trip_id, current_driver)
+    
+    background_tasks.add_task(
+        notify_trip_passengers, started_trip.id,
+        f"Votre trajet {started_trip.route_summary} a commencé.", RIDE_NOTIFIED_STATUSES
+    )
+    
+    return MessageResponse(
+        message=f"Trajet {started_trip.route_summary} démarré avec succès ! "
+               f"Bon voyage et conduisez prudemment.",
+        success=True
+    )
 
 
 @router.post("/{trip_id}/complete", response_model=MessageResponse)
 async def complete_trip(
     trip_id: int,
-    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db),
     current_driver: User = Depends(get_current_driver)
 ):
     """
@@ -373,30 +315,27 @@ async def complete_trip(
     Marque le trajet comme "terminé" et finalise les gains.
     Les passagers pourront alors évaluer le conducteur.
     """
-    try:
-        completed_trip = TripService.mark_trip_as_completed(db, trip_id, current_driver)
-        
-        return MessageResponse(
-            message=f"Trajet {completed_trip.route_summary} terminé avec succès ! "
-                   f"Vos gains: {completed_trip.driver_earnings} FCFA. "
-                   f"Merci d'avoir utilisé notre plateforme.",
-            success=True
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la finalisation: {str(e)}"
-        )
+    completed_trip = await TripService.mark_trip_as_completed(db, trip_id, current_driver)
+    
+    background_tasks.add_task(
+        notify_trip_passengers, completed_trip.id,
+        f"Votre trajet {completed_trip.route_summary} est terminé. Pensez à noter le conducteur !",
+        RIDE_NOTIFIED_STATUSES
+    )
+    
+    return MessageResponse(
+        message=f"Trajet {completed_trip.route_summary} terminé avec succès ! "
+               f"Vos gains: {completed_trip.driver_earnings} FCFA. "
+               f"Merci d'avoir utilisé notre plateforme.",
+        success=True
+    )
 
 
 # Endpoints de recherche avancée
 
 @router.get("/search/popular-routes", response_model=List[dict])
 async def get_popular_routes(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     limit: int = Query(10, description="Nombre de routes à retourner", ge=1, le=50)
 ):
     """
@@ -405,34 +344,7 @@ async def get_popular_routes(
     Retourne les trajets les plus fréquents basés sur l'historique.
     Utile pour suggérer des destinations populaires.
     """
-    try:
-        # Requête pour les routes populaires (simplifié pour le MVP)
-        popular_routes = db.execute("""
-            SELECT 
-                departure_city,
-                arrival_city,
-                COUNT(*) as trip_count,
-                AVG(price_per_seat) as avg_price
-            FROM trips 
-            WHERE status != 'CANCELLED'
-            GROUP BY departure_city, arrival_city
-            ORDER BY trip_count DESC
-            LIMIT :limit
-        """, {"limit": limit}).fetchall()
-        
-        return [
-            {
-                "departure_city": route.departure_city,
-                "arrival_city": route.arrival_city,
-                "trip_count": route.trip_count,
-                "avg_price": float(route.avg_price) if route.avg_price else 0,
-                "route": f"{route.departure_city} → {route.arrival_city}"
-            }
-            for route in popular_routes
-        ]
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Erreur lors de la récupération: {str(e)}"
-        )
\ No newline at end of file
+    # Agrégat mis en cache 5 minutes, invalidé à la création / annulation d'un trajet
+    routes = await TripService.get_popular_routes(db, limit)
+    # Dictionnaires déjà prêts pour JSON : pas de passage par jsonable_encoder
+    return Response(content=json.dumps(routes, ensure_ascii=False), media_type="application/json")
@@ -2,11 +2,17 @@
 Schemas Pydantic pour l'authentification
 Validation des données d'entrée et de sortie
 """
-from pydantic import BaseModel, EmailStr, validator
+from pydantic import BaseModel, ConfigDict, EmailStr, field_validator
 from typing import Optional
 from datetime import datetime
+import re
 from src.models.user import UserType, UserStatus
 
+# Expressions compilées une seule fois (validateurs appelés à chaque inscription/connexion)
+_PHONE_SEPARATORS_RE = re.compile(r"[+ -]")
+_PHONE_RE = re.compile(r"\d{8,12}")
+_OTP_RE = re.compile(r"\d{6}")
+
 
 class UserRegisterRequest(BaseModel):
     """Schema pour l'inscription d'un nouvel utilisateur"""
@@ -19,26 +25,29 @@ class UserRegisterRequest(BaseModel):
     city: Optional[str] = None
     neighborhood: Optional[str] = None
 
-    @validator('phone')
+    @field_validator('phone')
+    @classmethod
     def validate_phone(cls, v):
         # Validation basique du numéro de téléphone ivoirien
         if not v.startswith(('+225', '225', '0')):
             raise ValueError('Le numéro doit être un numéro ivoirien valide')
         # Nettoyer le numéro
-        cleaned = v.replace('+', '').replace(' ', '').replace('-', '')
-        if not cleaned.isdigit():
-            raise ValueError('Le numéro ne doit contenir que des chiffres')
-        if len(cleaned) < 8 or len(cleaned) > 12:
+        cleaned = _PHONE_SEPARATORS_RE.sub('', v)
+        if not _PHONE_RE.fullmatch(cleaned):
+            if not cleaned.isdigit():
+                raise ValueError('Le numéro ne doit contenir que des chiffres')
             raise ValueError('Le numéro doit contenir entre 8 et 12 chiffres')
         return cleaned
 
-    @validator('password')
+    @field_validator('password')
+    @classmethod
     def validate_password(cls, v):
         if len(v) < 6:
             raise ValueError('Le mot de passe doit contenir au moins 6 caractères')
         return v
 
-    @validator('first_name', 'last_name')
+    @field_validator('first_name', 'last_name')
+    @classmethod
     def validate_names(cls, v):
         if len(v.strip()) < 2:
             raise ValueError('Le nom doit contenir au moins 2 caractères')
@@ -50,10 +59,11 @@ class UserLoginRequest(BaseModel):
     phone: str
     password: str
 
-    @validator('phone')
+    @field_validator('phone')
+    @classmethod
     def validate_phone(cls, v):
         # Même validation que pour l'inscription
-        cleaned = v.replace('+', '').replace(' ', '').replace('-', '')
+        cleaned = _PHONE_SEPARATORS_RE.sub('', v)
         if not cleaned.isdigit():
             raise ValueError('Format de numéro invalide')
         return cleaned
@@ -64,9 +74,10 @@ class VerifyPhoneRequest(BaseModel):
     phone: str
     otp_code: str
 
-    @validator('otp_code')
+    @field_validator('otp_code')
+    @classmethod
     def validate_otp(cls, v):
-        if not v.isdigit() or len(v) != 6:
+        if not _OTP_RE.fullmatch(v):
             raise ValueError('Le code OTP doit contenir exactement 6 chiffres')
         return v
 
@@ -81,7 +92,8 @@ class ChangePasswordRequest(BaseModel):
     current_password: str
     new_password: str
 
-    @validator('new_password')
+    @field_validator('new_password')
+    @classmethod
     def validate_new_password(cls, v):
         if len(v) < 6:
             raise ValueError('Le nouveau mot de passe doit contenir au moins 6 caractères')
@@ -94,7 +106,8 @@ class ResetPasswordRequest(BaseModel):
     otp_code: str
     new_password: str
 
-    @validator('new_password')
+    @field_validator('new_password')
+    @classmethod
     def validate_new_password(cls, v):
         if len(v) < 6:
             raise ValueError('Le nouveau mot de passe doit contenir au moins 6 caractères')
@@ -120,7 +133,7 @@ class UserProfileResponse(BaseModel):
     email: Optional[str]
     first_name: str
     last_name: str
-    full_name: str
+    full_name: str  # Attribut full_name du modèle User
     user_type: UserType
     status: UserStatus
     city: Optional[str]
@@ -134,14 +147,7 @@ class UserProfileResponse(BaseModel):
     created_at: datetime
     last_login: Optional[datetime]
 
-    class Config:
-        from_attributes = True  # Pour SQLAlchemy models
-
-    @validator('full_name', pre=True, always=True)
-    def set_full_name(cls, v, values):
-        if 'first_name' in values and 'last_name' in values:
-            return f"{values['first_name']} {values['last_name']}"
-        return v
+    model_config = ConfigDict(from_attributes=True)  # Pour SQLAlchemy models
 
 
 class AuthResponse(BaseModel):
@@ -177,26 +183,30 @@ class DriverVerificationRequest(BaseModel):
     vehicle_plate: str
     vehicle_seats: int
 
-    @validator('vehicle_year')
+    @field_validator('vehicle_year')
+    @classmethod
     def validate_year(cls, v):
         current_year = datetime.now().year
         if v < 1990 or v > current_year + 1:
             raise ValueError(f'Année du véhicule invalide (1990-{current_year + 1})')
         return v
 
-    @validator('vehicle_seats')
+    @field_validator('vehicle_seats')
+    @classmethod
     def validate_seats(cls, v):
         if v < 2 or v > 9:
             raise ValueError('Le nombre de places doit être entre 2 et 9')
         return v
 
-    @validator('driver_license_number')
+    @field_validator('driver_license_number')
+    @classmethod
     def validate_license(cls, v):
         if len(v.strip()) < 5:
             raise ValueError('Numéro de permis invalide')
         return v.strip().upper()
 
-    @validator('vehicle_plate')
+    @field_validator('vehicle_plate')
+    @classmethod
     def validate_plate(cls, v):
         if len(v.strip()) < 4:
             raise ValueError('Plaque d\'immatriculation invalide')
@@ -1,8 +1,9 @@
 """
 Schemas Pydantic pour les données géographiques
 """
-from pydantic import BaseModel, validator, Field
+from pydantic import BaseModel, ConfigDict, ValidationInfo, field_validator, Field
 from typing import Optional, List, Tuple
+import numpy as np
 from src.services.geo import Coordinates, RouteInfo, GeocodingResult
 
 
@@ -18,6 +19,15 @@ class GeocodingRequest(BaseModel):
     city: Optional[str] = Field(None, max_length=100, description="Ville (optionnel)")
 
 
+# Nombre max d'adresses par géocodage groupé (Nominatim limite le débit)
+MAX_GEOCODE_BATCH = 20
+
+
+class GeocodingBatchRequest(BaseModel):
+    """Schema pour géocoder plusieurs adresses en un appel"""
+    addresses: List[GeocodingRequest] = Field(..., min_length=1, max_length=MAX_GEOCODE_BATCH)
+
+
 class RouteCalculationRequest(BaseModel):
     """Schema pour calculer un itinéraire"""
     start_latitude: float = Field(..., ge=-90, le=90)
@@ -26,6 +36,49 @@ class RouteCalculationRequest(BaseModel):
     end_longitude: float = Field(..., ge=-180, le=180)
 
 
+# Nombre max d'itinéraires par matrice (chaque absence de cache coûte un appel OSRM)
+MAX_ROUTE_MATRIX = 25
+
+
+class RouteMatrixRequest(BaseModel):
+    """Schema pour calculer plusieurs itinéraires en un appel"""
+    routes: List[RouteCalculationRequest] = Field(..., min_length=1, max_length=MAX_ROUTE_MATRIX)
+
+
+# Nombre max de paires par calcul groupé
+MAX_DISTANCE_BATCH = 1000
+
+
+class DistanceBatchRequest(BaseModel):
+    """Schema pour calculer plusieurs distances en un appel (tableaux de même taille)"""
+    lat1: List[float] = Field(..., min_length=1, max_length=MAX_DISTANCE_BATCH)
+    lng1: List[float] = Field(..., min_length=1, max_length=MAX_DISTANCE_BATCH)
+    lat2: List[float] = Field(..., min_length=1, max_length=MAX_DISTANCE_BATCH)
+    lng2: List[float] = Field(..., min_length=1, max_length=MAX_DISTANCE_BATCH)
+
+    @field_validator('lat1', 'lat2')
+    @classmethod
+    def validate_latitudes(cls, v):
+        if any(not -90 <= lat <= 90 for lat in v):
+            raise ValueError('Les latitudes doivent être comprises entre -90 et 90')
+        return v
+
+    @field_validator('lng1', 'lng2')
+    @classmethod
+    def validate_longitudes(cls, v):
+        if any(not -180 <= lng <= 180 for lng in v):
+            raise ValueError('Les longitudes doivent être comprises entre -180 et 180')
+        return v
+
+    @field_validator('lng2')
+    @classmethod
+    def validate_same_length(cls, v, info: ValidationInfo):
+        lengths = {len(info.data[k]) for k in ('lat1', 'lng1', 'lat2') if k in info.data}
+        if lengths and lengths != {len(v)}:
+            raise ValueError('Les tableaux lat1, lng1, lat2 et lng2 doivent avoir la même taille')
+        return v
+
+
 class NearbySearchRequest(BaseModel):
     """Schema pour rechercher des points à proximité"""
     latitude: float = Field(..., ge=-90, le=90)
@@ -63,6 +116,12 @@ class GeocodingResponse(BaseModel):
         )
 
 
+class GeocodingBatchResponse(BaseModel):
+    """Schema de réponse pour le géocodage groupé (None si adresse introuvable)"""
+    results: List[Optional[GeocodingResponse]]
+    total_found: int
+
+
 class RouteResponse(BaseModel):
     """Schema de réponse pour un itinéraire"""
     distance_km: float
@@ -80,6 +139,12 @@ class RouteResponse(BaseModel):
         )
 
 
+class RouteMatrixResponse(BaseModel):
+    """Schema de réponse pour une matrice d'itinéraires (ordre de la requête)"""
+    routes: List[RouteResponse]
+    total: int
+
+
 class TripRouteResponse(BaseModel):
     """Schema complet pour l'itinéraire d'un trajet"""
     trip_id: Optional[int] = None
@@ -118,6 +183,14 @@ class DistanceCalculationResponse(BaseModel):
     estimated_price: Optional[float] = None
 
 
+class DistanceBatchResponse(BaseModel):
+    """Schema de réponse pour le calcul groupé de distances"""
+    distances_km: List[float]
+    estimated_durations_minutes: List[int]
+    estimated_prices: List[float]
+    total: int
+
+
 class MapBoundsResponse(BaseModel):
     """Schema pour les limites d'une carte"""
     north: float
@@ -138,13 +211,13 @@ class MapBoundsResponse(BaseModel):
                 center=CoordinatesResponse(latitude=5.3, longitude=-4.0)
             )
         
-        lats = [c.latitude for c in coords_list]
-        lngs = [c.longitude for c in coords_list]
-        
-        north = max(lats)
-        south = min(lats)
-        east = max(lngs)
-        west = min(lngs)
+        # Une seule passe : tableau (n, 2) puis min/max vectorisés
+        arr = np.fromiter(
+            (v for c in coords_list for v in (c.latitude, c.longitude)),
+            dtype=np.float64, count=len(coords_list) * 2
+        ).reshape(-1, 2)
+        south, west = arr.min(axis=0).tolist()
+        north, east = arr.max(axis=0).tolist()
         
         # Ajouter une marge de 10%
         lat_margin = (north - south) * 0.1
@@ -179,22 +252,21 @@ class TripMapDataResponse(BaseModel):
     dropoff_markers: Optional[List[CoordinatesResponse]] = None
     map_bounds: MapBoundsResponse
     
-    class Config:
-        schema_extra = {
-            "example": {
-                "trip_id": 1,
-                "departure_marker": {"latitude": 5.3472, "longitude": -4.0243},
-                "arrival_marker": {"latitude": 5.3200, "longitude": -4.0100},
-                "route_polyline": [[5.3472, -4.0243], [5.3350, -4.0180], [5.3200, -4.0100]],
-                "map_bounds": {
-                    "north": 5.36,
-                    "south": 5.31,
-                    "east": -4.00,
-                    "west": -4.03,
-                    "center": {"latitude": 5.335, "longitude": -4.015}
-                }
+    model_config = ConfigDict(json_schema_extra={
+        "example": {
+            "trip_id": 1,
+            "departure_marker": {"latitude": 5.3472, "longitude": -4.0243},
+            "arrival_marker": {"latitude": 5.3200, "longitude": -4.0100},
+            "route_polyline": [[5.3472, -4.0243], [5.3350, -4.0180], [5.3200, -4.0100]],
+            "map_bounds": {
+                "north": 5.36,
+                "south": 5.31,
+                "east": -4.00,
+                "west": -4.03,
+                "center": {"latitude": 5.335, "longitude": -4.015}
             }
         }
+    })
 
 
 class GeolocationValidationResponse(BaseModel):
@@ -2,7 +2,7 @@
 Schemas Pydantic pour les réservations
 Validation des données d'entrée et de sortie
 """
-from pydantic import BaseModel, validator, Field
+from pydantic import BaseModel, ConfigDict, TypeAdapter, Field
 from typing import Optional, List
 from datetime import datetime
 from src.models.reservation import ReservationStatus, PaymentMethod, PaymentStatus
@@ -11,7 +11,7 @@ from src.models.reservation import ReservationStatus, PaymentMethod, PaymentStat
 class ReservationCreateRequest(BaseModel):
     """Schema pour créer une nouvelle réservation"""
     trip_id: int = Field(..., gt=0)
-    number_of_seats: int = Field(1, ge=1, le=8)
+    number_of_seats: int = Field(1, ge=1, le=8, description="Nombre de places (entre 1 et 8)")
     pickup_address: Optional[str] = Field(None, max_length=255)
     pickup_latitude: Optional[float] = Field(None, ge=-90, le=90)
     pickup_longitude: Optional[float] = Field(None, ge=-180, le=180)
@@ -21,12 +21,6 @@ class ReservationCreateRequest(BaseModel):
     special_requests: Optional[str] = Field(None, max_length=500)
     payment_method: Optional[PaymentMethod] = PaymentMethod.CASH
 
-    @validator('number_of_seats')
-    def validate_seats(cls, v):
-        if v < 1 or v > 8:
-            raise ValueError('Le nombre de places doit être entre 1 et 8')
-        return v
-
 
 class ReservationUpdateRequest(BaseModel):
     """Schema pour modifier une réservation"""
@@ -52,15 +46,9 @@ class ReservationConfirmRequest(BaseModel):
 
 class RatingRequest(BaseModel):
     """Schema pour noter un trajet"""
-    rating: int = Field(..., ge=1, le=5)
+    rating: int = Field(..., ge=1, le=5, description="Note entre 1 et 5")
     comment: Optional[str] = Field(None, max_length=300)
 
-    @validator('rating')
-    def validate_rating(cls, v):
-        if v < 1 or v > 5:
-            raise ValueError('La note doit être entre 1 et 5')
-        return v
-
 
 # ================ RESPONSES ================
 
@@ -74,8 +62,7 @@ class PassengerResponse(BaseModel):
     total_ratings: int
     trips_as_passenger: int
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class TripSummaryResponse(BaseModel):
@@ -88,8 +75,7 @@ class TripSummaryResponse(BaseModel):
     driver_name: Optional[str] = None
     vehicle_info: Optional[str] = None
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class ReservationResponse(BaseModel):
@@ -127,8 +113,11 @@ class ReservationResponse(BaseModel):
     trip: Optional[TripSummaryResponse]
     passenger: Optional[PassengerResponse]
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+# Validation d'une liste entière en un seul appel au cœur compilé de pydantic
+reservation_list_adapter = TypeAdapter(List[ReservationResponse])
 
 
 class ReservationListResponse(BaseModel):
@@ -167,36 +156,33 @@ class TripReservationsResponse(BaseModel):
     total_earnings: float
 
 
+# Contenus fixes des réponses (copiés par instance : les listes/dicts restent modifiables)
+_NEXT_STEPS = (
+    "Votre demande de réservation a été envoyée au conducteur",
+    "Vous recevrez une notification dès que le conducteur aura répondu",
+    "Vous pouvez annuler votre réservation jusqu'à 2h avant le départ"
+)
+_PASSENGER_CONTACT = {
+    "phone": "Visible après confirmation",
+    "pickup_point": "Selon les détails de la réservation"
+}
+
+
 class ReservationCreateResponse(BaseModel):
     """Réponse après création d'une réservation"""
     message: str
     reservation: ReservationResponse
-    next_steps: List[str]
+    next_steps: List[str] = Field(default_factory=lambda: list(_NEXT_STEPS))
     success: bool = True
 
-    @validator('next_steps', pre=True, always=True)
-    def set_next_steps(cls, v, values):
-        return [
-            "Votre demande de réservation a été envoyée au conducteur",
-            "Vous recevrez une notification dès que le conducteur aura répondu",
-            "Vous pouvez annuler votre réservation jusqu'à 2h avant le départ"
-        ]
-
 
 class ReservationConfirmResponse(BaseModel):
     """Réponse après confirmation d'une réservation"""
     message: str
     reservation: ReservationResponse
-    passenger_contact: dict
+    passenger_contact: dict = Field(default_factory=_PASSENGER_CONTACT.copy)
     success: bool = True
 
-    @validator('passenger_contact', pre=True, always=True)
-    def set_contact(cls, v, values):
-        return {
-            "phone": "Visible après confirmation",
-            "pickup_point": "Selon les détails de la réservation"
-        }
-
 
 class ReservationStatsResponse(BaseModel):
     """Statistiques des réservations"""
@@ -219,5 +205,4 @@ class PaymentResponse(BaseModel):
     payment_url: Optional[str]  # Pour Mobile Money
     success: bool
 
-    class Config:
-        from_attributes = True
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
@@ -2,7 +2,7 @@
 Schemas Pydantic pour les trajets
 Validation des données d'entrée et de sortie
 """
-from pydantic import BaseModel, validator, Field
+from pydantic import BaseModel, ConfigDict, TypeAdapter, Field
 from typing import Optional, List
 from datetime import datetime
 from src.models.trip import TripType, TripStatus
@@ -75,6 +75,7 @@ class TripSearchFilters(BaseModel):
     
     page: int = Field(1, ge=1)
     per_page: int = Field(20, ge=1, le=100)
+    cursor: Optional[str] = None  # Pagination par clé (prioritaire sur page)
 
 
 class DriverResponse(BaseModel):
@@ -90,8 +91,7 @@ class DriverResponse(BaseModel):
     vehicle_seats: Optional[int]
     trips_as_driver: int
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class TripResponse(BaseModel):
@@ -120,8 +120,11 @@ class TripResponse(BaseModel):
     description: Optional[str]
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+# Validation d'une liste entière en un seul appel au cœur compilé de pydantic
+trip_list_adapter = TypeAdapter(List[TripResponse])
 
 
 class TripListResponse(BaseModel):
@@ -133,6 +136,7 @@ class TripListResponse(BaseModel):
     total_pages: int
     has_next: bool
     has_prev: bool
+    next_cursor: Optional[str] = None  # À renvoyer en `cursor` pour la page suivante
 
 
 class TripStatsResponse(BaseModel):
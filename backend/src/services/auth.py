@@ -2,27 +2,200 @@
 Service d'authentification
 Gestion des tokens JWT, hashage des mots de passe, etc.
 """
+import asyncio
+import base64
+import calendar
+import hashlib
+import hmac
+from functools import lru_cache, partial
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import event, case, literal, select, update, DateTime, Enum
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
-import secrets
+import json
+import os
+import threading
+import time
 import redis
 from src.models.user import User, UserStatus
 from src.config import get_settings
+from src.database import get_redis, get_async_redis
 
 settings = get_settings()
 
-# Configuration du hashage des mots de passe
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Configuration du hashage des mots de passe (coût réglable, hash existants toujours vérifiables)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 
 # Configuration JWT
 SECRET_KEY = settings.JWT_SECRET_KEY
 ALGORITHM = settings.JWT_ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 
+# Encodage JWT HMAC : en-tête encodé et clé HMAC préparés une seule fois
+_HMAC_DIGESTS = {"HS256": hashlib.sha256, "HS384": hashlib.sha384, "HS512": hashlib.sha512}
+
+
+def _b64url(raw: bytes) -> bytes:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=")
+
+
+_JWT_HEADER_B64 = _b64url(json.dumps(
+    {"alg": ALGORITHM, "typ": "JWT"}, separators=(",", ":"), sort_keys=True
+).encode())
+# Copié (.copy()) à chaque signature : la clé n'est pas re-dérivée ; None = algorithme non HMAC
+_JWT_SIGNER = (
+    hmac.new(SECRET_KEY.encode(), digestmod=_HMAC_DIGESTS[ALGORITHM])
+    if ALGORITHM in _HMAC_DIGESTS else None
+)
+
+# Décodeur JWT lié une seule fois (clé, algorithmes et options figés à l'import)
+_decode_token = partial(
+    jwt.decode,
+    key=SECRET_KEY,
+    algorithms=(ALGORITHM,),
+    options={"require_exp": True, "require_sub": True}
+)
+
+# Tokens déjà vérifiés (signature + claims), par processus : le même token revient à chaque requête
+TOKEN_CACHE_SIZE = 10_000
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def _decode_token_cached(token: str) -> Dict[str, Any]:
+    """Décodage mémorisé ; les tokens invalides lèvent et ne sont donc jamais mis en cache"""
+    return _decode_token(token)
+
+
+# OTP
+OTP_EXPIRE_SECONDS = 300  # 5 minutes
+OTP_MAX_ATTEMPTS = 5
+OTP_POOL_SIZE = 256  # Codes tirés par lecture d'entropie
+
+# Réserve de codes OTP : un seul os.urandom par lot au lieu d'un tirage par code
+_format_otp = "{:06d}".format
+_otp_pool = []
+_otp_pool_lock = threading.Lock()
+# 3 octets = 0..16 777 215 : on rejette au-delà de 16 000 000 pour garder un modulo 10^6 uniforme
+_OTP_UNBIASED_LIMIT = 16_000_000
+
+
+def _refill_otp_pool() -> None:
+    raw = os.urandom(3 * OTP_POOL_SIZE)
+    for i in range(0, len(raw), 3):
+        value = int.from_bytes(raw[i:i + 3], "big")
+        if value < _OTP_UNBIASED_LIMIT:
+            _otp_pool.append(_format_otp(value % 1_000_000))
+
+# Vérification OTP atomique en un aller-retour : lecture, essai compté, suppression si correct
+# Retour : 1 = valide, 0 = incorrect, -1 = expiré, -2 = trop d'essais (code invalidé)
+_VERIFY_OTP_LUA = """
+local stored = redis.call('GET', KEYS[1])
+if not stored then return -1 end
+local attempts = redis.call('INCR', KEYS[2])
+if attempts > tonumber(ARGV[2]) then
+    redis.call('DEL', KEYS[1], KEYS[2])
+    return -2
+end
+if stored ~= ARGV[1] then return 0 end
+redis.call('DEL', KEYS[1], KEYS[2])
+return 1
+"""
+
+
+@lru_cache(maxsize=None)
+def _verify_otp_script(redis_client: redis.Redis):
+    """Script Lua enregistré une fois par client Redis (EVALSHA ensuite)"""
+    return redis_client.register_script(_VERIFY_OTP_LUA)
+
+
+# Colonnes lues pour vérifier un mot de passe (le profil complet n'est chargé qu'en cas de succès)
+_LOGIN_COLUMNS = (User.id, User.password_hash, User.is_active)
+
+# Limitation des tentatives de connexion
+LOGIN_MAX_ATTEMPTS = 5
+LOGIN_ATTEMPT_WINDOW = 60  # secondes
+
+
+def _login_attempts_key(phone: str, client_ip: str) -> str:
+    return f"login:att:{phone}:{client_ip}"
+
+
+# Cache Redis des profils utilisateurs (get_current_user)
+USER_CACHE_TTL = 60  # secondes
+USER_CACHE_PREFIX = "auth:user:"
+# Colonnes jamais mises en cache (rechargées à la demande depuis la DB)
+# bio est différée : la lire ici déclencherait une requête à chaque mise en cache
+USER_CACHE_EXCLUDED = frozenset({"password_hash", "bio"})
+
+
+def _user_cache_key(user_id: int) -> str:
+    return f"{USER_CACHE_PREFIX}{user_id}"
+
+
+def _serialize_user(user: User) -> str:
+    """Sérialise les colonnes d'un utilisateur pour le cache Redis"""
+    data = {}
+    for column in User.__table__.columns:
+        if column.key in USER_CACHE_EXCLUDED:
+            continue
+        value = getattr(user, column.key)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif hasattr(value, "value"):  # Enum Python
+            value = value.value
+        data[column.key] = value
+    return json.dumps(data)
+
+
+def _deserialize_user(raw: str) -> User:
+    """Reconstruit un utilisateur détaché (non modifié) depuis le cache Redis"""
+    data = json.loads(raw)
+    for column in User.__table__.columns:
+        value = data.get(column.key)
+        if value is None:
+            continue
+        if isinstance(column.type, DateTime):
+            data[column.key] = datetime.fromisoformat(value)
+        elif isinstance(column.type, Enum) and column.type.enum_class is not None:
+            data[column.key] = column.type.enum_class(value)
+    user = User(**data)
+    # Marque l'instance comme persistante détachée : attributs propres, colonnes absentes expirées
+    make_transient_to_detached(user)
+    return user
+
+
+def _invalidate_cached_user_id(user_id: int) -> None:
+    """Supprime le profil en cache d'un utilisateur"""
+    redis_client = get_redis()
+    if redis_client is None:
+        return
+    try:
+        redis_client.delete(_user_cache_key(user_id))
+    except redis.RedisError:
+        pass
+
+
+async def invalidate_cached_user(user_id: int) -> None:
+    """Supprime le profil en cache d'un utilisateur, depuis une coroutine (UPDATE en masse)"""
+    redis_client = get_async_redis()
+    if redis_client is None:
+        return
+    try:
+        await redis_client.delete(_user_cache_key(user_id))
+    except redis.RedisError:
+        pass
+
+
+@event.listens_for(User, "after_update")
+def _invalidate_cached_user(mapper, connection, target):
+    """Invalide le profil en cache dès qu'un utilisateur est modifié en base (flush ORM)"""
+    _invalidate_cached_user_id(target.id)
+
 
 class AuthService:
     """Service d'authentification"""
@@ -52,86 +225,140 @@ class AuthService:
         
         to_encode.update({"exp": expire, "iat": datetime.utcnow()})
         
-        encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-        return encoded_jwt
+        if _JWT_SIGNER is None:
+            return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+        
+        # Dates en secondes epoch (UTC), comme python-jose
+        for claim in ("exp", "iat"):
+            to_encode[claim] = calendar.timegm(to_encode[claim].utctimetuple())
+        
+        signing_input = _JWT_HEADER_B64 + b"." + _b64url(
+            json.dumps(to_encode, separators=(",", ":")).encode()
+        )
+        signer = _JWT_SIGNER.copy()
+        signer.update(signing_input)
+        return (signing_input + b"." + _b64url(signer.digest())).decode()
 
     @staticmethod
     def verify_token(token: str) -> Dict[str, Any]:
-        """Vérifie et décode un token JWT"""
+        """Vérifie et décode un token JWT (signature vérifiée une fois par processus)"""
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            return payload
+            payload = _decode_token_cached(token)
         except JWTError:
+            payload = None
+        
+        # Expiration revérifiée à chaque appel : le cache ne prolonge pas un token
+        if payload is None or payload["exp"] <= time.time():
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Token invalide",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        return payload
 
-    def register_user(self, db: Session, user_data: dict) -> User:
+    async def register_user(self, db: AsyncSession, user_data: dict) -> User:
         """Inscrit un nouvel utilisateur"""
         
-        # Vérifier si l'utilisateur existe déjà
-        existing_user = db.query(User).filter(User.phone == user_data["phone"]).first()
-        if existing_user:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Un utilisateur avec ce numéro de téléphone existe déjà"
-            )
-        
-        # Vérifier l'email s'il est fourni
-        if user_data.get("email"):
-            existing_email = db.query(User).filter(User.email == user_data["email"]).first()
-            if existing_email:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Un utilisateur avec cet email existe déjà"
-                )
+        # Hasher le mot de passe (le mot de passe en clair n'est pas une colonne)
+        user_data["password_hash"] = await asyncio.to_thread(self.hash_password, user_data.pop("password"))
         
-        # Hasher le mot de passe
-        hashed_password = self.hash_password(user_data["password"])
-        
-        # Créer l'utilisateur
-        db_user = User(
-            phone=user_data["phone"],
-            email=user_data.get("email"),
-            first_name=user_data["first_name"],
-            last_name=user_data["last_name"],
-            password_hash=hashed_password,
-            user_type=user_data["user_type"],
-            city=user_data.get("city"),
-            neighborhood=user_data.get("neighborhood"),
-            status=UserStatus.PENDING
+        # Créer l'utilisateur en une instruction : les contraintes uniques (phone, email) tranchent,
+        # sans fenêtre de course entre vérification et insertion ; RETURNING renvoie id, created_at...
+        db_user = await db.scalar(
+            pg_insert(User)
+            .values(**user_data, status=UserStatus.PENDING)
+            .on_conflict_do_nothing()
+            .returning(User)
         )
         
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        if db_user is None:
+            # Conflit : identifier la contrainte en cause pour un message précis
+            if await self.user_exists_by_phone(db, user_data["phone"]):
+                detail = "Un utilisateur avec ce numéro de téléphone existe déjà"
+            else:
+                detail = "Un utilisateur avec cet email existe déjà"
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+        
+        await db.commit()
         
         # Générer et envoyer l'OTP
         self.send_otp(db_user.phone)
         
         return db_user
 
-    def authenticate_user(self, db: Session, phone: str, password: str) -> Optional[User]:
-        """Authentifie un utilisateur"""
-        user = db.query(User).filter(User.phone == phone).first()
+    @staticmethod
+    async def user_exists_by_phone(db: AsyncSession, phone: str) -> bool:
+        """Vérifie l'existence d'un utilisateur en ne lisant que son ID"""
+        result = await db.execute(select(User.id).where(User.phone == phone))
+        return result.scalar() is not None
+
+    @staticmethod
+    async def get_user_by_phone(db: AsyncSession, phone: str) -> Optional[User]:
+        """Récupère un utilisateur par son numéro de téléphone"""
+        result = await db.execute(select(User).where(User.phone == phone))
+        return result.scalars().first()
+
+    def check_login_rate_limit(self, phone: str, client_ip: str) -> None:
+        """
+        Compte les tentatives de connexion par couple (numéro, IP) (fenêtre glissante Redis)
+        Lève une erreur 429 au-delà de LOGIN_MAX_ATTEMPTS ; un tiers ne peut pas bloquer
+        la connexion d'un numéro depuis une autre adresse
+        """
+        if not self.redis_client:
+            return
+        
+        attempts_key = _login_attempts_key(phone, client_ip)
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.incr(attempts_key)
+            pipe.expire(attempts_key, LOGIN_ATTEMPT_WINDOW)
+            attempts, _ = pipe.execute()
+        except redis.RedisError:
+            return
+        
+        if attempts > LOGIN_MAX_ATTEMPTS:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Trop de tentatives de connexion. Réessayez dans une minute.",
+                headers={"Retry-After": str(LOGIN_ATTEMPT_WINDOW)}
+            )
+
+    def reset_login_attempts(self, phone: str, client_ip: str) -> None:
+        """Réinitialise le compteur après une connexion réussie"""
+        if not self.redis_client:
+            return
+        try:
+            self.redis_client.delete(_login_attempts_key(phone, client_ip))
+        except redis.RedisError:
+            pass
+
+    async def authenticate_user(self, db: AsyncSession, phone: str, password: str) -> Optional[User]:
+        """Authentifie un utilisateur (bcrypt exécuté hors de la boucle d'événements)"""
+        credentials = (await db.execute(
+            select(*_LOGIN_COLUMNS).where(User.phone == phone)
+        )).one_or_none()
         
-        if not user:
+        if credentials is None:
             return None
         
-        if not self.verify_password(password, user.password_hash):
+        if not await asyncio.to_thread(self.verify_password, password, credentials.password_hash):
             return None
         
-        if not user.is_active:
+        if not credentials.is_active:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Compte désactivé"
             )
         
-        # Mettre à jour la dernière connexion
-        user.last_login = datetime.utcnow()
-        db.commit()
+        # Dernière connexion mise à jour et profil complet (updated_at compris) en un seul UPDATE ... RETURNING
+        user = await db.scalar(
+            update(User)
+            .where(User.id == credentials.id)
+            .values(last_login=datetime.utcnow())
+            .returning(User)
+        )
+        await db.commit()
+        await invalidate_cached_user(user.id)
         
         return user
 
@@ -155,10 +382,14 @@ class AuthService:
             "phone": user.phone
         }
 
-    def get_current_user(self, db: Session, token: str) -> User:
-        """Récupère l'utilisateur actuel à partir du token"""
+    async def get_current_user(self, db: AsyncSession, token: str, payload: Optional[Dict[str, Any]] = None) -> User:
+        """
+        Récupère l'utilisateur actuel à partir du token
+        payload : token déjà décodé (AuthMiddleware), évite une seconde vérification
+        """
         try:
-            payload = self.verify_token(token)
+            if payload is None:
+                payload = self.verify_token(token)
             user_id: int = int(payload.get("sub"))
             if user_id is None:
                 raise HTTPException(
@@ -171,7 +402,7 @@ class AuthService:
                 detail="Token invalide"
             )
         
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await self.get_user_cached(db, user_id)
         if user is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -186,19 +417,53 @@ class AuthService:
         
         return user
 
+    @staticmethod
+    async def get_user_cached(db: AsyncSession, user_id: int) -> Optional[User]:
+        """
+        Charge un utilisateur via le cache Redis (TTL court), sinon depuis la DB
+        L'instance en cache est rattachée à la session pour rester modifiable
+        password_hash et bio ne sont pas chargées (pas de lazy load en asynchrone) : les relire explicitement
+        """
+        cache_key = _user_cache_key(user_id)
+        redis_client = get_async_redis()
+        
+        if redis_client is not None:
+            try:
+                cached = await redis_client.get(cache_key)
+            except redis.RedisError:
+                cached = None
+            if cached:
+                return await db.merge(_deserialize_user(cached), load=False)
+        
+        # Lecture par clé primaire : identity map de la session d'abord, SQL sinon
+        user = await db.get(User, user_id)
+        
+        if user is not None and redis_client is not None:
+            try:
+                await redis_client.setex(cache_key, USER_CACHE_TTL, _serialize_user(user))
+            except redis.RedisError:
+                pass
+        
+        return user
+
     def generate_otp(self) -> str:
-        """Génère un code OTP à 6 chiffres"""
-        return f"{secrets.randbelow(1000000):06d}"
+        """Génère un code OTP à 6 chiffres (pris dans la réserve du processus)"""
+        with _otp_pool_lock:
+            if not _otp_pool:
+                _refill_otp_pool()
+            return _otp_pool.pop()
 
     def send_otp(self, phone: str) -> str:
         """Envoie un code OTP par SMS"""
         # Générer le code OTP
         otp_code = self.generate_otp()
         
-        # Stocker dans Redis avec expiration de 5 minutes
+        # Stocker dans Redis avec expiration de 5 minutes (code + compteur d'essais, un seul aller-retour)
         if self.redis_client:
-            otp_key = f"otp:{phone}"
-            self.redis_client.setex(otp_key, 300, otp_code)  # 5 minutes
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.setex(f"otp:{phone}", OTP_EXPIRE_SECONDS, otp_code)
+            pipe.setex(f"otp:att:{phone}", OTP_EXPIRE_SECONDS, 0)
+            pipe.execute()
         
         # TODO: Intégrer avec un service SMS réel (ex: Twilio, Orange SMS API)
         # Pour le développement, on affiche le code dans les logs
@@ -213,25 +478,35 @@ class AuthService:
             return otp_code == "123456"
         
         otp_key = f"otp:{phone}"
-        stored_otp = self.redis_client.get(otp_key)
+        attempts_key = f"otp:att:{phone}"
         
-        if not stored_otp:
+        # Lecture, comptage de l'essai et suppression si correct : un seul aller-retour
+        result = _verify_otp_script(self.redis_client)(
+            keys=[otp_key, attempts_key], args=[otp_code, OTP_MAX_ATTEMPTS]
+        )
+        
+        if result == -1:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Code OTP expiré ou invalide"
             )
         
-        if stored_otp != otp_code:
+        if result == -2:
+            # Trop d'essais : le code est invalidé, il faut en redemander un
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Trop de tentatives. Veuillez demander un nouveau code OTP."
+            )
+        
+        if result == 0:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Code OTP incorrect"
             )
         
-        # Supprimer le code après vérification
-        self.redis_client.delete(otp_key)
         return True
 
-    def verify_phone_number(self, db: Session, phone: str, otp_code: str) -> User:
+    async def verify_phone_number(self, db: AsyncSession, phone: str, otp_code: str) -> User:
         """Vérifie le numéro de téléphone avec OTP"""
         
         # Vérifier l'OTP
@@ -241,41 +516,58 @@ class AuthService:
                 detail="Code OTP invalide"
             )
         
-        # Trouver l'utilisateur
-        user = db.query(User).filter(User.phone == phone).first()
-        if not user:
+        # Marquer comme vérifié (PENDING -> VERIFIED) en un seul UPDATE ... RETURNING
+        user = await db.scalar(
+            update(User)
+            .where(User.phone == phone)
+            .values(
+                is_phone_verified=True,
+                status=case(
+                    (User.status == UserStatus.PENDING, literal(UserStatus.VERIFIED, User.status.type)),
+                    else_=User.status
+                )
+            )
+            .returning(User)
+        )
+        if user is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Utilisateur non trouvé"
             )
         
-        # Marquer comme vérifié
-        user.is_phone_verified = True
-        if user.status == UserStatus.PENDING:
-            user.status = UserStatus.VERIFIED
-        
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        # UPDATE en masse : pas d'événement after_update, invalidation explicite
+        await invalidate_cached_user(user.id)
         
         return user
 
-    def change_password(self, db: Session, user: User, current_password: str, new_password: str) -> bool:
-        """Change le mot de passe d'un utilisateur"""
+    async def change_password(self, db: AsyncSession, user: User, current_password: str, new_password: str) -> bool:
+        """Change le mot de passe d'un utilisateur (bcrypt exécuté hors de la boucle d'événements)"""
+        
+        # Hash actuel relu en base : il n'est pas conservé dans le profil en cache
+        current_hash = await db.scalar(select(User.password_hash).where(User.id == user.id))
         
         # Vérifier le mot de passe actuel
-        if not self.verify_password(current_password, user.password_hash):
+        if not await asyncio.to_thread(self.verify_password, current_password, current_hash):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Mot de passe actuel incorrect"
             )
         
         # Hasher le nouveau mot de passe
-        user.password_hash = self.hash_password(new_password)
+        password_hash = await asyncio.to_thread(self.hash_password, new_password)
+        await db.execute(
+            update(User)
+            .where(User.id == user.id)
+            .values(password_hash=password_hash)
+        )
         
-        db.commit()
+        await db.commit()
+        # UPDATE en masse : pas d'événement after_update (ni de DELETE Redis synchrone)
+        await invalidate_cached_user(user.id)
         return True
 
-    def reset_password(self, db: Session, phone: str, otp_code: str, new_password: str) -> User:
+    async def reset_password(self, db: AsyncSession, phone: str, otp_code: str, new_password: str) -> User:
         """Réinitialise le mot de passe avec OTP"""
         
         # Vérifier l'OTP
@@ -285,19 +577,22 @@ class AuthService:
                 detail="Code OTP invalide"
             )
         
-        # Trouver l'utilisateur
-        user = db.query(User).filter(User.phone == phone).first()
-        if not user:
+        # Changer le mot de passe en un seul UPDATE ... RETURNING
+        password_hash = await asyncio.to_thread(self.hash_password, new_password)
+        user = await db.scalar(
+            update(User)
+            .where(User.phone == phone)
+            .values(password_hash=password_hash)
+            .returning(User)
+        )
+        if user is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Utilisateur non trouvé"
             )
         
-        # Changer le mot de passe
-        user.password_hash = self.hash_password(new_password)
-        
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await invalidate_cached_user(user.id)
         
         return user
 
@@ -2,12 +2,24 @@
 Service géographique
 Géocodage, calculs de distance et gestion des cartes
 """
+import json
 import math
+import numpy as np
+import redis
 import requests
+from functools import lru_cache
 from typing import Optional, Dict, List, Tuple
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 from fastapi import HTTPException, status
 
+from src.database import get_redis
+from src.utils.geo import haversine_km, haversine_np
+
+# Cache des appels aux fournisseurs externes (Nominatim / OSRM)
+GEOCODE_CACHE_TTL = 30 * 86400  # 30 jours : les adresses bougent rarement
+ROUTE_CACHE_TTL = 86400         # 1 jour
+ROUTE_CACHE_PRECISION = 4       # 4 décimales ≈ 11 m : le bruit GPS retombe sur la même clé
+
 
 @dataclass
 class Coordinates:
@@ -37,6 +49,35 @@ class GeocodingResult:
     country: Optional[str] = None
 
 
+def _normalize(value: Optional[str]) -> str:
+    """Normalise une adresse pour les clés de cache"""
+    return (value or "").strip().lower()
+
+
+def _geocode_cache_key(address_key: str, city_key: str) -> str:
+    return f"geo:{address_key}|{city_key}"
+
+
+def _geocoding_from_json(raw: str) -> GeocodingResult:
+    data = json.loads(raw)
+    data["coordinates"] = Coordinates(**data["coordinates"])
+    return GeocodingResult(**data)
+
+
+def _route_from_json(raw: str) -> RouteInfo:
+    data = json.loads(raw)
+    data["coordinates"] = [tuple(point) for point in data["coordinates"]]
+    return RouteInfo(**data)
+
+
+class _GeocodeMiss(Exception):
+    """Adresse introuvable (levée pour que lru_cache ne mémorise pas l'échec)"""
+
+
+class _RouteMiss(Exception):
+    """Itinéraire introuvable (levée pour que lru_cache ne mémorise pas l'échec)"""
+
+
 class GeoService:
     """Service de géolocalisation et cartographie"""
     
@@ -49,32 +90,96 @@ class GeoService:
         Calcule la distance entre deux coordonnées (formule haversine)
         Retourne la distance en kilomètres
         """
-        # Rayon de la Terre en km
-        R = 6371.0
+        return self.distance_km(coord1.latitude, coord1.longitude, coord2.latitude, coord2.longitude)
+    
+    def distance_km(self, lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+        """Distance haversine en km (2 décimales) à partir de flottants, sans objet Coordinates"""
+        return round(haversine_km(lat1, lng1, lat2, lng2), 2)
+    
+    def calculate_distances(self, lat1, lon1, lat2, lon2) -> np.ndarray:
+        """
+        Calcule N distances (haversine) en un seul passage NumPy
+        Tableaux de même taille en degrés ; retourne les distances en km (2 décimales)
+        """
+        arrays = (np.asarray(values, dtype=np.float64) for values in (lat1, lon1, lat2, lon2))
+        return np.round(haversine_np(*arrays), 2)
+    
+    def estimate_trip_prices(self, distances_km: np.ndarray, base_price_per_km: float = 100) -> np.ndarray:
+        """
+        Version vectorisée de estimate_trip_price (même grille tarifaire, sans boucle Python)
+        """
+        base_price = distances_km * base_price_per_km
+        return np.select(
+            [distances_km <= 0, distances_km < 10, distances_km > 100],
+            [0.0, np.maximum(base_price, 500), base_price * 0.9],
+            default=np.round(base_price, -1)
+        )
+    
+    def geocode_address(self, address: str, city: str = None) -> Optional[GeocodingResult]:
+        """
+        Géocode une adresse en coordonnées
+        Cache à deux niveaux (mémoire du processus puis Redis) devant Nominatim
+        """
+        try:
+            return self._geocode_cached(_normalize(address), _normalize(city))
+        except _GeocodeMiss:
+            return None
+    
+    def geocode_addresses(self, addresses: List[Tuple[str, Optional[str]]]) -> List[Optional[GeocodingResult]]:
+        """
+        Géocode plusieurs adresses : un seul MGET Redis, Nominatim pour les absentes
+        """
+        results = self.cached_geocodes(addresses)
+        return [
+            result if result is not None else self.geocode_address(address, city)
+            for (address, city), result in zip(addresses, results)
+        ]
+    
+    def cached_geocodes(self, addresses: List[Tuple[str, Optional[str]]]) -> List[Optional[GeocodingResult]]:
+        """
+        Résultats déjà présents dans Redis (un seul MGET) ; None pour les adresses absentes du cache
+        """
+        redis_client = get_redis()
+        if redis_client is None or not addresses:
+            return [None] * len(addresses)
+        
+        keys = [_geocode_cache_key(_normalize(address), _normalize(city)) for address, city in addresses]
+        try:
+            cached_values = redis_client.mget(keys)
+        except redis.RedisError:
+            return [None] * len(addresses)
+        
+        return [_geocoding_from_json(cached) if cached else None for cached in cached_values]
+    
+    @lru_cache(maxsize=4096)
+    def _geocode_cached(self, address_key: str, city_key: str) -> GeocodingResult:
+        """Niveau mémoire (LRU) puis Redis ; lève _GeocodeMiss si l'adresse est introuvable"""
+        cache_key = _geocode_cache_key(address_key, city_key)
+        redis_client = get_redis()
         
-        # Conversion en radians
-        lat1_rad = math.radians(coord1.latitude)
-        lon1_rad = math.radians(coord1.longitude)
-        lat2_rad = math.radians(coord2.latitude)
-        lon2_rad = math.radians(coord2.longitude)
+        if redis_client is not None:
+            try:
+                cached = redis_client.get(cache_key)
+            except redis.RedisError:
+                cached = None
+            if cached:
+                return _geocoding_from_json(cached)
         
-        # Différences
-        dlat = lat2_rad - lat1_rad
-        dlon = lon2_rad - lon1_rad
+        result = self._geocode_upstream(address_key, city_key or None)
+        if result is None:
+            raise _GeocodeMiss(address_key)
         
-        # Formule haversine
-        a = (math.sin(dlat / 2)**2 + 
-             math.cos(lat1_rad) * math.cos(lat2_rad) * 
-             math.sin(dlon / 2)**2)
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+        if redis_client is not None:
+            try:
+                redis_client.setex(cache_key, GEOCODE_CACHE_TTL, json.dumps(asdict(result)))
+            except redis.RedisError:
+                pass
         
-        distance = R * c
-        return round(distance, 2)
+        return result
     
-    def geocode_address(self, address: str, city: str = None) -> Optional[GeocodingResult]:
+    def _geocode_upstream(self, address: str, city: str = None) -> Optional[GeocodingResult]:
         """
-        Géocode une adresse en coordonnées
-        Utilise Nominatim (OpenStreetMap)
+        Géocode une adresse via Nominatim (OpenStreetMap), sans cache
         """
         try:
             # Construire la requête
@@ -156,9 +261,65 @@ class GeoService:
             return None
     
     def calculate_route(self, start: Coordinates, end: Coordinates) -> Optional[RouteInfo]:
+        """Calcule un itinéraire entre deux points (voir route_between)"""
+        return self.route_between(start.latitude, start.longitude, end.latitude, end.longitude)
+    
+    def route_between(self, start_lat: float, start_lng: float, end_lat: float, end_lng: float) -> RouteInfo:
         """
         Calcule un itinéraire entre deux points
-        Utilise OSRM (Open Source Routing Machine)
+        Utilise OSRM (Open Source Routing Machine), avec cache à deux niveaux (mémoire puis Redis)
+        Les extrémités sont arrondies à ROUTE_CACHE_PRECISION décimales pour partager les entrées
+        """
+        try:
+            return self._route_cached(
+                round(start_lat, ROUTE_CACHE_PRECISION), round(start_lng, ROUTE_CACHE_PRECISION),
+                round(end_lat, ROUTE_CACHE_PRECISION), round(end_lng, ROUTE_CACHE_PRECISION)
+            )
+        except _RouteMiss:
+            return self._straight_line_route(start_lat, start_lng, end_lat, end_lng)
+    
+    @lru_cache(maxsize=1024)
+    def _route_cached(self, start_lat: float, start_lng: float, end_lat: float, end_lng: float) -> RouteInfo:
+        """Niveau mémoire (LRU) puis Redis ; lève _RouteMiss si OSRM ne trouve pas d'itinéraire"""
+        cache_key = f"route:{start_lat},{start_lng};{end_lat},{end_lng}"
+        redis_client = get_redis()
+        
+        if redis_client is not None:
+            try:
+                cached = redis_client.get(cache_key)
+            except redis.RedisError:
+                cached = None
+            if cached:
+                return _route_from_json(cached)
+        
+        route = self._route_upstream(Coordinates(start_lat, start_lng), Coordinates(end_lat, end_lng))
+        
+        # Seuls les itinéraires OSRM sont mis en cache (pas le repli en ligne droite)
+        if route is None:
+            raise _RouteMiss(cache_key)
+        
+        if redis_client is not None:
+            try:
+                redis_client.setex(cache_key, ROUTE_CACHE_TTL, json.dumps(asdict(route)))
+            except redis.RedisError:
+                pass
+        
+        return route
+    
+    def _straight_line_route(self, start_lat: float, start_lng: float, end_lat: float, end_lng: float) -> RouteInfo:
+        """Itinéraire de repli : distance directe, ~40 km/h de moyenne"""
+        distance = self.distance_km(start_lat, start_lng, end_lat, end_lng)
+        estimated_duration = int(distance * 1.5)
+        
+        return RouteInfo(
+            distance_km=distance,
+            duration_minutes=estimated_duration,
+            coordinates=[(start_lat, start_lng), (end_lat, end_lng)]
+        )
+    
+    def _route_upstream(self, start: Coordinates, end: Coordinates) -> Optional[RouteInfo]:
+        """
+        Interroge OSRM ; retourne None si aucun itinéraire n'est trouvé
         """
         try:
             # URL OSRM
@@ -191,28 +352,11 @@ class GeoService:
                         coordinates=coordinates
                     )
             
-            # Fallback : calcul distance directe si pas de route
-            distance = self.calculate_distance(start, end)
-            estimated_duration = int(distance * 1.5)  # ~40 km/h moyenne
-            
-            return RouteInfo(
-                distance_km=distance,
-                duration_minutes=estimated_duration,
-                coordinates=[(start.latitude, start.longitude), (end.latitude, end.longitude)]
-            )
+            return None
             
         except Exception as e:
             print(f"Erreur calcul route: {e}")
-            
-            # Fallback en cas d'erreur
-            distance = self.calculate_distance(start, end)
-            estimated_duration = int(distance * 1.5)
-            
-            return RouteInfo(
-                distance_km=distance,
-                duration_minutes=estimated_duration,
-                coordinates=[(start.latitude, start.longitude), (end.latitude, end.longitude)]
-            )
+            return None
     
     def find_nearby_points(self, center: Coordinates, radius_km: float, point_type: str = "city") -> List[GeocodingResult]:
         """
@@ -248,7 +392,14 @@ class GeoService:
             results = []
             if response.status_code == 200:
                 data = response.json()
-                for item in data:
+                if not data:
+                    return results
+                # La viewbox est un carré : ne garder que les points dans le rayon (un seul passage NumPy)
+                coords = np.array([(float(item["lat"]), float(item["lon"])) for item in data])
+                within = haversine_np(center.latitude, center.longitude, coords[:, 0], coords[:, 1]) <= radius_km
+                for item, keep in zip(data, within.tolist()):
+                    if not keep:
+                        continue
                     results.append(GeocodingResult(
                         address=item.get("display_name", ""),
                         coordinates=Coordinates(
@@ -2,28 +2,75 @@
 Service de gestion des réservations
 Logique métier pour la réservation, confirmation et gestion des trajets
 """
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from typing import List, Optional, Dict, Any, Tuple
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc, asc
+from sqlalchemy.orm import Session, selectinload, load_only
+from sqlalchemy import and_, or_, desc, asc, func, select, update
 from fastapi import HTTPException, status
 import math
 
 from src.models.reservation import Reservation, ReservationStatus, PaymentStatus, PaymentMethod
 from src.models.trip import Trip, TripStatus
 from src.models.user import User
-from src.services.trip import TripService
+
+# Champs modifiables par le passager sur une réservation en attente
+_MUTABLE_FIELDS = frozenset({
+    "pickup_address", "pickup_latitude", "pickup_longitude",
+    "dropoff_address", "dropoff_latitude", "dropoff_longitude",
+    "special_requests"
+})
+
+
+# Relations sérialisées avec chaque réservation : une requête IN par liste,
+# limitée aux colonnes de TripSummaryResponse / PassengerResponse
+_TRIP_SUMMARY = selectinload(Reservation.trip).options(load_only(
+    Trip.id, Trip.departure_city, Trip.arrival_city, Trip.departure_datetime, Trip.price_per_seat
+))
+_PASSENGER_SUMMARY = selectinload(Reservation.passenger).options(load_only(
+    User.id, User.first_name, User.last_name, User.phone,
+    User.rating_average, User.total_ratings, User.trips_as_passenger
+))
+
+
+@dataclass(slots=True, frozen=True)
+class MyReservations:
+    """Réservations d'un passager, une page par catégorie"""
+    active: List[Reservation]
+    completed: List[Reservation]
+    cancelled: List[Reservation]
+
+
+@dataclass(slots=True, frozen=True)
+class TripReservations:
+    """Réservations d'un trajet, une page par catégorie"""
+    pending: List[Reservation]
+    confirmed: List[Reservation]
+    cancelled: List[Reservation]
 
 
 class ReservationService:
     """Service de gestion des réservations"""
 
+    @staticmethod
+    def _get_trip(db: Session, trip_id: int) -> Trip:
+        """Récupère un trajet par son ID (identity map d'abord), 404 sinon"""
+        trip = db.get(Trip, trip_id)
+        
+        if not trip:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Trajet non trouvé"
+            )
+        
+        return trip
+
     @staticmethod
     def create_reservation(db: Session, reservation_data: dict, passenger: User, trip_id: int) -> Reservation:
         """Crée une nouvelle réservation"""
         
         # Récupérer le trajet
-        trip = TripService.get_trip_by_id(db, trip_id)
+        trip = ReservationService._get_trip(db, trip_id)
         
         # Vérifications préliminaires
         if not passenger.is_phone_verified:
@@ -132,6 +179,49 @@ class ReservationService:
         
         return reservation
 
+    @staticmethod
+    def update_reservation(db: Session, reservation_id: int, passenger: User, update_data: dict) -> Reservation:
+        """
+        Modifie une réservation en attente (passager) en un seul UPDATE ... RETURNING
+        Le commit revient à l'appelant (après sérialisation, pour éviter le rechargement post-commit)
+        """
+        values = {field: update_data[field] for field in update_data.keys() & _MUTABLE_FIELDS}
+        
+        stmt = (
+            update(Reservation)
+            .where(
+                Reservation.id == reservation_id,
+                Reservation.passenger_id == passenger.id,
+                Reservation.status == ReservationStatus.PENDING
+            )
+            .values(**values, updated_at=func.now())
+            .returning(Reservation)
+            .execution_options(synchronize_session=False)
+        )
+        reservation = db.execute(stmt).scalar_one_or_none()
+        
+        if reservation is None:
+            # Diagnostic uniquement en cas d'échec : quelle condition n'est pas remplie
+            row = db.query(Reservation.passenger_id, Reservation.status).filter(
+                Reservation.id == reservation_id
+            ).first()
+            if not row:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Réservation non trouvée"
+                )
+            if row.passenger_id != passenger.id:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Seul le passager peut modifier cette réservation"
+                )
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Seule une réservation en attente peut être modifiée"
+            )
+        
+        return reservation
+
     @staticmethod
     def confirm_reservation(db: Session, reservation_id: int, conductor: User, accept: bool, message: str = None) -> Reservation:
         """Confirme ou refuse une réservation (conducteur)"""
@@ -235,11 +325,12 @@ class ReservationService:
         return reservation
 
     @staticmethod
-    def get_my_reservations(db: Session, passenger: User) -> Dict[str, List[Reservation]]:
-        """Récupère toutes les réservations d'un passager"""
+    def get_my_reservations(db: Session, passenger: User, limit: int = 20, offset: int = 0) -> MyReservations:
+        """Récupère les réservations d'un passager (une page par catégorie)"""
+        # Trajets préchargés (_TRIP_SUMMARY) ; le passager est l'utilisateur courant, déjà en session
         
         # Réservations actives
-        active_reservations = db.query(Reservation).filter(
+        active_reservations = db.query(Reservation).options(_TRIP_SUMMARY).filter(
             Reservation.passenger_id == passenger.id,
             Reservation.status.in_([
                 ReservationStatus.PENDING,
@@ -247,34 +338,84 @@ class ReservationService:
                 ReservationStatus.PAID,
                 ReservationStatus.STARTED
             ])
-        ).order_by(desc(Reservation.created_at)).all()
+        ).order_by(desc(Reservation.created_at)).offset(offset).limit(limit).all()
         
         # Réservations terminées
-        completed_reservations = db.query(Reservation).filter(
+        completed_reservations = db.query(Reservation).options(_TRIP_SUMMARY).filter(
             Reservation.passenger_id == passenger.id,
             Reservation.status == ReservationStatus.COMPLETED
-        ).order_by(desc(Reservation.actual_dropoff_time)).limit(10).all()
+        ).order_by(desc(Reservation.actual_dropoff_time)).offset(offset).limit(limit).all()
         
         # Réservations annulées
-        cancelled_reservations = db.query(Reservation).filter(
+        cancelled_reservations = db.query(Reservation).options(_TRIP_SUMMARY).filter(
             Reservation.passenger_id == passenger.id,
             Reservation.status.in_([
                 ReservationStatus.CANCELLED_BY_PASSENGER,
                 ReservationStatus.CANCELLED_BY_DRIVER,
                 ReservationStatus.NO_SHOW
             ])
-        ).order_by(desc(Reservation.cancelled_at)).limit(5).all()
+        ).order_by(desc(Reservation.cancelled_at)).offset(offset).limit(limit).all()
+        
+        return MyReservations(
+            active=active_reservations,
+            completed=completed_reservations,
+            cancelled=cancelled_reservations
+        )
+
+    @staticmethod
+    def get_reservation_stats(db: Session, user_id: int, as_driver: bool = False) -> Dict[str, Any]:
+        """
+        Statistiques de réservation agrégées côté base (une ligne, aucune réservation chargée)
+        as_driver : réservations des trajets du conducteur ; sinon celles du passager
+        """
+        completed = Reservation.status == ReservationStatus.COMPLETED
+        
+        query = select(
+            func.count().label("total"),
+            func.count().filter(Reservation.status == ReservationStatus.PENDING).label("pending"),
+            func.count().filter(Reservation.status.in_([
+                ReservationStatus.CONFIRMED,
+                ReservationStatus.PAID
+            ])).label("confirmed"),
+            func.count().filter(completed).label("completed"),
+            func.count().filter(Reservation.status.in_([
+                ReservationStatus.CANCELLED_BY_PASSENGER,
+                ReservationStatus.CANCELLED_BY_DRIVER,
+                ReservationStatus.NO_SHOW
+            ])).label("cancelled"),
+            func.coalesce(func.sum(Reservation.total_price).filter(completed), 0.0).label("completed_amount"),
+            func.avg(Reservation.driver_rating).filter(completed).label("average_driver_rating")
+        )
         
-        return {
-            "active_reservations": active_reservations,
-            "completed_reservations": completed_reservations,
-            "cancelled_reservations": cancelled_reservations
-        }
+        if as_driver:
+            query = query.join(Trip, Reservation.trip_id == Trip.id).where(Trip.driver_id == user_id)
+        else:
+            query = query.where(Reservation.passenger_id == user_id)
+        
+        return db.execute(query).one()._asdict()
 
     @staticmethod
-    def get_trip_reservations(db: Session, trip_id: int, conductor: User) -> Dict[str, List[Reservation]]:
-        """Récupère toutes les réservations d'un trajet (conducteur)"""
-        trip = TripService.get_trip_by_id(db, trip_id)
+    def get_trip_reservation_totals(db: Session, trip_id: int) -> Dict[str, Any]:
+        """Totaux d'un trajet sur toutes ses réservations (une seule requête d'agrégation)"""
+        confirmed = Reservation.status.in_([
+            ReservationStatus.CONFIRMED,
+            ReservationStatus.PAID,
+            ReservationStatus.STARTED
+        ])
+        
+        query = select(
+            # Mêmes catégories que les listes (en attente, confirmées, annulées)
+            func.count().filter(Reservation.status != ReservationStatus.COMPLETED).label("total"),
+            func.coalesce(func.sum(Reservation.number_of_seats).filter(confirmed), 0).label("confirmed_passengers"),
+            func.coalesce(func.sum(Reservation.total_price).filter(confirmed), 0.0).label("confirmed_amount")
+        ).where(Reservation.trip_id == trip_id)
+        
+        return db.execute(query).one()._asdict()
+
+    @staticmethod
+    def get_trip_reservations(db: Session, trip_id: int, conductor: User, limit: int = 20, offset: int = 0) -> TripReservations:
+        """Récupère les réservations d'un trajet (conducteur, une page par catégorie)"""
+        trip = ReservationService._get_trip(db, trip_id)
         
         if trip.driver_id != conductor.id:
             raise HTTPException(
@@ -282,37 +423,38 @@ class ReservationService:
                 detail="Accès refusé"
             )
         
+        # Passagers préchargés (_PASSENGER_SUMMARY) ; le trajet est déjà en session (_get_trip)
         # Réservations en attente
-        pending_reservations = db.query(Reservation).filter(
+        pending_reservations = db.query(Reservation).options(_PASSENGER_SUMMARY).filter(
             Reservation.trip_id == trip_id,
             Reservation.status == ReservationStatus.PENDING
-        ).order_by(asc(Reservation.created_at)).all()
+        ).order_by(asc(Reservation.created_at)).offset(offset).limit(limit).all()
         
         # Réservations confirmées
-        confirmed_reservations = db.query(Reservation).filter(
+        confirmed_reservations = db.query(Reservation).options(_PASSENGER_SUMMARY).filter(
             Reservation.trip_id == trip_id,
             Reservation.status.in_([
                 ReservationStatus.CONFIRMED,
                 ReservationStatus.PAID,
                 ReservationStatus.STARTED
             ])
-        ).order_by(asc(Reservation.confirmed_at)).all()
+        ).order_by(asc(Reservation.confirmed_at)).offset(offset).limit(limit).all()
         
         # Réservations annulées
-        cancelled_reservations = db.query(Reservation).filter(
+        cancelled_reservations = db.query(Reservation).options(_PASSENGER_SUMMARY).filter(
             Reservation.trip_id == trip_id,
             Reservation.status.in_([
                 ReservationStatus.CANCELLED_BY_PASSENGER,
                 ReservationStatus.CANCELLED_BY_DRIVER,
                 ReservationStatus.NO_SHOW
             ])
-        ).order_by(desc(Reservation.cancelled_at)).all()
+        ).order_by(desc(Reservation.cancelled_at)).offset(offset).limit(limit).all()
         
-        return {
-            "pending_reservations": pending_reservations,
-            "confirmed_reservations": confirmed_reservations,
-            "cancelled_reservations": cancelled_reservations
-        }
+        return TripReservations(
+            pending=pending_reservations,
+            confirmed=confirmed_reservations,
+            cancelled=cancelled_reservations
+        )
 
     @staticmethod
     def mark_reservation_as_started(db: Session, reservation_id: int, user: User) -> Reservation:
@@ -371,7 +513,7 @@ class ReservationService:
             reservation.passenger_comment = comment
             
             # Mettre à jour la note moyenne du conducteur
-            driver = reservation.trip.driver
+            driver = db.get(User, reservation.trip.driver_id)
             driver.update_rating(rating)
             
         elif reservation.trip.driver_id == user.id:
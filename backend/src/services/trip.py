@@ -2,23 +2,98 @@
 Service de gestion des trajets
 Logique métier pour la création, modification et recherche de trajets
 """
+import base64
+import json
+import logging
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any, Tuple
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc, asc
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, desc, asc, func, select, update, text, tuple_
 from fastapi import HTTPException, status
-import math
+import redis
 
-from src.models.trip import Trip, TripStatus, TripType
+from src.database import AsyncSessionLocal, get_async_redis
+from src.models.trip import Trip, TripStatus, TripType, PREF_PETS
+from src.models.reservation import Reservation, ReservationStatus
 from src.models.user import User, UserType
-from src.schemas.trip import TripSearchFilters
+from src.schemas.trip import TripCreateRequest, TripUpdateRequest, TripSearchFilters
+from src.services.auth import invalidate_cached_user
+
+logger = logging.getLogger(__name__)
+
+# Routes populaires : agrégat sur toute la table, mis en cache (top 50, tronqué à la demande)
+POPULAR_ROUTES_CACHE_KEY = "trips:popular_routes"
+POPULAR_ROUTES_CACHE_TTL = 300  # 5 minutes
+POPULAR_ROUTES_MAX = 50
+
+# Requête compilée une seule fois (cache de compilation SQLAlchemy + requête préparée asyncpg)
+_POPULAR_ROUTES_SQL = text("""
+    SELECT 
+        departure_city,
+        arrival_city,
+        COUNT(*) as trip_count,
+        AVG(price_per_seat) as avg_price
+    FROM trips 
+    WHERE status != 'cancelled'
+    GROUP BY departure_city, arrival_city
+    ORDER BY trip_count DESC
+    LIMIT :limit
+""")
+
+
+def encode_trip_cursor(trip: Trip) -> str:
+    """Curseur opaque de pagination : (departure_datetime, id) du dernier trajet de la page"""
+    raw = f"{trip.departure_datetime.isoformat()}|{trip.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_trip_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        moment, trip_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(moment), int(trip_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Curseur de pagination invalide"
+        )
+
+
+async def _invalidate_popular_routes() -> None:
+    """Supprime le cache des routes populaires (création / annulation de trajet)"""
+    redis_client = get_async_redis()
+    if redis_client is not None:
+        try:
+            await redis_client.delete(POPULAR_ROUTES_CACHE_KEY)
+        except redis.RedisError:
+            pass
+
+
+# Réservations à prévenir selon l'événement du trajet
+CANCEL_NOTIFIED_STATUSES = (ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.PAID)
+RIDE_NOTIFIED_STATUSES = (ReservationStatus.CONFIRMED, ReservationStatus.PAID, ReservationStatus.STARTED)
+
+
+async def notify_trip_passengers(trip_id: int, message: str, statuses=CANCEL_NOTIFIED_STATUSES) -> None:
+    """
+    Notifie les passagers d'un trajet (tâche de fond, après l'envoi de la réponse)
+    Ouvre sa propre session : celle de la requête n'est plus garantie à ce stade
+    """
+    async with AsyncSessionLocal() as db:
+        phones = (await db.scalars(
+            select(User.phone)
+            .join(Reservation, Reservation.passenger_id == User.id)
+            .where(Reservation.trip_id == trip_id, Reservation.status.in_(statuses))
+        )).all()
+    
+    for phone in phones:
+        logger.info("Notification pour %s: %s", phone, message)
 
 
 class TripService:
     """Service de gestion des trajets"""
 
     @staticmethod
-    def create_trip(db: Session, trip_data: dict, driver: User) -> Trip:
+    async def create_trip(db: AsyncSession, trip_data: TripCreateRequest, driver: User) -> Trip:
         """Crée un nouveau trajet"""
         
         # Vérifications préliminaires
@@ -29,10 +104,13 @@ class TripService:
             )
         
         # Vérifier que le conducteur n'a pas trop de trajets actifs
-        active_trips_count = db.query(Trip).filter(
-            Trip.driver_id == driver.id,
-            Trip.status.in_([TripStatus.ACTIVE, TripStatus.FULL])
-        ).count()
+        result = await db.execute(
+            select(func.count()).select_from(Trip).where(
+                Trip.driver_id == driver.id,
+                Trip.status.in_([TripStatus.ACTIVE, TripStatus.FULL])
+            )
+        )
+        active_trips_count = result.scalar_one()
         
         if active_trips_count >= 5:  # Limite à 5 trajets actifs
             raise HTTPException(
@@ -40,51 +118,35 @@ class TripService:
                 detail="Vous avez atteint la limite de trajets actifs (5 maximum)"
             )
         
-        # Créer le trajet
+        # Créer le trajet : champs du schéma repris tels quels (un seul model_dump)
         new_trip = Trip(
+            **trip_data.model_dump(),
             driver_id=driver.id,
-            departure_address=trip_data["departure_address"],
-            departure_city=trip_data["departure_city"],
-            departure_latitude=trip_data.get("departure_latitude"),
-            departure_longitude=trip_data.get("departure_longitude"),
-            arrival_address=trip_data["arrival_address"],
-            arrival_city=trip_data["arrival_city"],
-            arrival_latitude=trip_data.get("arrival_latitude"),
-            arrival_longitude=trip_data.get("arrival_longitude"),
-            departure_datetime=trip_data["departure_datetime"],
-            estimated_duration_minutes=trip_data.get("estimated_duration_minutes"),
-            total_seats=trip_data["available_seats"],
-            available_seats=trip_data["available_seats"],
-            price_per_seat=trip_data["price_per_seat"],
-            total_distance_km=trip_data.get("total_distance_km"),
-            trip_type=trip_data["trip_type"],
-            accepts_pets=trip_data["accepts_pets"],
-            accepts_smoking=trip_data["accepts_smoking"],
-            accepts_food=trip_data["accepts_food"],
-            luggage_allowed=trip_data["luggage_allowed"],
-            max_detour_km=trip_data["max_detour_km"],
-            description=trip_data.get("description"),
-            special_instructions=trip_data.get("special_instructions"),
-            is_recurring=trip_data["is_recurring"],
-            recurring_days=trip_data.get("recurring_days"),
-            recurring_end_date=trip_data.get("recurring_end_date"),
+            total_seats=trip_data.available_seats,
             status=TripStatus.ACTIVE
         )
         
         db.add(new_trip)
-        db.commit()
-        db.refresh(new_trip)
         
-        # Mettre à jour les statistiques du conducteur
-        driver.trips_as_driver += 1
-        db.commit()
+        # Statistiques du conducteur : incrément SQL, dans la même transaction que le trajet
+        await db.execute(
+            update(User)
+            .where(User.id == driver.id)
+            .values(trips_as_driver=User.trips_as_driver + 1)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        await db.refresh(new_trip)
+        # UPDATE en masse : pas d'événement after_update, invalidation explicite du profil en cache
+        await invalidate_cached_user(driver.id)
+        await _invalidate_popular_routes()
         
         return new_trip
 
     @staticmethod
-    def get_trip_by_id(db: Session, trip_id: int, current_user: Optional[User] = None) -> Trip:
+    async def get_trip_by_id(db: AsyncSession, trip_id: int, current_user: Optional[User] = None) -> Trip:
         """Récupère un trajet par son ID"""
-        trip = db.query(Trip).filter(Trip.id == trip_id).first()
+        trip = await db.get(Trip, trip_id)
         
         if not trip:
             raise HTTPException(
@@ -95,9 +157,9 @@ class TripService:
         return trip
 
     @staticmethod
-    def update_trip(db: Session, trip_id: int, update_data: dict, driver: User) -> Trip:
+    async def update_trip(db: AsyncSession, trip_id: int, update_data: TripUpdateRequest, driver: User) -> Trip:
         """Met à jour un trajet"""
-        trip = TripService.get_trip_by_id(db, trip_id)
+        trip = await TripService.get_trip_by_id(db, trip_id)
         
         # Vérifier que c'est bien le conducteur du trajet
         if trip.driver_id != driver.id:
@@ -121,21 +183,21 @@ class TripService:
                 detail="Impossible de modifier un trajet moins de 2h avant le départ"
             )
         
-        # Mettre à jour les champs modifiables
-        for field, value in update_data.items():
-            if value is not None and hasattr(trip, field):
+        # Mettre à jour les seuls champs envoyés (test sur la classe : pas de chargement des colonnes différées)
+        for field, value in update_data.model_dump(exclude_unset=True).items():
+            if value is not None and hasattr(Trip, field):
                 setattr(trip, field, value)
         
         trip.updated_at = datetime.now()
-        db.commit()
-        db.refresh(trip)
+        await db.commit()
+        await db.refresh(trip)
         
         return trip
 
     @staticmethod
-    def cancel_trip(db: Session, trip_id: int, driver: User, reason: str) -> Trip:
+    async def cancel_trip(db: AsyncSession, trip_id: int, driver: User, reason: str) -> Trip:
         """Annule un trajet"""
-        trip = TripService.get_trip_by_id(db, trip_id)
+        trip = await TripService.get_trip_by_id(db, trip_id)
         
         # Vérifier que c'est bien le conducteur du trajet
         if trip.driver_id != driver.id:
@@ -156,30 +218,31 @@ class TripService:
         trip.cancelled_at = datetime.now()
         trip.cancellation_reason = reason
         
-        db.commit()
+        await db.commit()
+        await _invalidate_popular_routes()
         
-        # TODO: Notifier les passagers qui ont réservé
         # TODO: Gérer les remboursements
         
         return trip
 
     @staticmethod
-    def search_trips(db: Session, filters: TripSearchFilters, current_user: Optional[User] = None) -> Tuple[List[Trip], int]:
+    async def search_trips(db: AsyncSession, filters: TripSearchFilters, current_user: Optional[User] = None) -> Tuple[List[Trip], int]:
         """Recherche les trajets selon les filtres"""
-        query = db.query(Trip).filter(Trip.status == TripStatus.ACTIVE)
+        # Trajets réservables uniquement (actifs, places libres, départ à venir)
+        query = select(Trip).where(Trip.bookable_clause())
         
         # Filtres de base
         if filters.departure_city:
-            query = query.filter(Trip.departure_city.ilike(f"%{filters.departure_city}%"))
+            query = query.where(Trip.departure_city.ilike(f"%{filters.departure_city}%"))
         
         if filters.arrival_city:
-            query = query.filter(Trip.arrival_city.ilike(f"%{filters.arrival_city}%"))
+            query = query.where(Trip.arrival_city.ilike(f"%{filters.arrival_city}%"))
         
         if filters.departure_date:
             # Recherche pour toute la journée
             start_date = filters.departure_date.replace(hour=0, minute=0, second=0)
             end_date = start_date + timedelta(days=1)
-            query = query.filter(
+            query = query.where(
                 and_(
                     Trip.departure_datetime >= start_date,
                     Trip.departure_datetime < end_date
@@ -187,55 +250,64 @@ class TripService:
             )
         
         if filters.min_seats:
-            query = query.filter(Trip.available_seats >= filters.min_seats)
+            query = query.where(Trip.available_seats >= filters.min_seats)
         
         if filters.max_price:
-            query = query.filter(Trip.price_per_seat <= filters.max_price)
+            query = query.where(Trip.price_per_seat <= filters.max_price)
         
         if filters.accepts_pets is not None:
-            query = query.filter(Trip.accepts_pets == filters.accepts_pets)
+            if filters.accepts_pets:
+                query = query.where(Trip.preferences_filter(required=PREF_PETS))
+            else:
+                query = query.where(Trip.preferences_filter(forbidden=PREF_PETS))
         
         if filters.trip_type:
-            query = query.filter(Trip.trip_type == filters.trip_type)
+            query = query.where(Trip.trip_type == filters.trip_type)
         
         # Filtre géographique (recherche par proximité)
-        if filters.latitude and filters.longitude and filters.radius_km:
-            # Calcul approximatif de distance (pour un filtre plus précis, utiliser PostGIS)
-            lat_range = filters.radius_km / 111.0  # 1 degré ≈ 111 km
-            lon_range = lat_range / math.cos(math.radians(filters.latitude))
-            
-            query = query.filter(
-                and_(
-                    Trip.departure_latitude.between(
-                        filters.latitude - lat_range,
-                        filters.latitude + lat_range
-                    ),
-                    Trip.departure_longitude.between(
-                        filters.longitude - lon_range,
-                        filters.longitude + lon_range
-                    )
-                )
+        if filters.latitude is not None and filters.longitude is not None and filters.radius_km:
+            query = query.where(
+                Trip.departure_near(filters.latitude, filters.longitude, filters.radius_km)
             )
         
         # Exclure les trajets de l'utilisateur connecté (s'il est conducteur)
         if current_user and current_user.is_driver:
-            query = query.filter(Trip.driver_id != current_user.id)
-        
-        # Compter le total
-        total_count = query.count()
+            query = query.where(Trip.driver_id != current_user.id)
         
-        # Tri par défaut : date de départ croissante
-        query = query.order_by(asc(Trip.departure_datetime))
-        
-        # Pagination
-        offset = (filters.page - 1) * filters.per_page
-        trips = query.offset(offset).limit(filters.per_page).all()
-        
-        return trips, total_count
+        # Pagination par clé : reprise directement après le dernier trajet vu (coût indépendant
+        # de la profondeur) ; le total devient alors le nombre de trajets restants
+        if filters.cursor:
+            query = query.where(
+                tuple_(Trip.departure_datetime, Trip.id) > tuple_(*decode_trip_cursor(filters.cursor))
+            )
+            offset = 0
+        else:
+            offset = (filters.page - 1) * filters.per_page
+        
+        # Page et total en une seule requête : COUNT(*) OVER () est évalué avant LIMIT/OFFSET
+        # Tri par défaut : date de départ croissante (id pour départager, stable pour le curseur)
+        paged = (
+            query.add_columns(func.count().over().label("total_count"))
+            .order_by(asc(Trip.departure_datetime), asc(Trip.id))
+            .offset(offset)
+            .limit(filters.per_page)
+        )
+        rows = (await db.execute(paged)).all()
+        
+        if rows:
+            return [row.Trip for row in rows], rows[0].total_count
+        
+        # Page vide : le total n'est connu que par un comptage séparé (au-delà de la première page)
+        if offset == 0:
+            return [], 0
+        total_count = (await db.execute(
+            query.with_only_columns(func.count(), maintain_column_froms=True)
+        )).scalar_one()
+        return [], total_count
 
     @staticmethod
-    def get_my_trips(db: Session, driver: User) -> Dict[str, List[Trip]]:
-        """Récupère tous les trajets d'un conducteur"""
+    async def get_my_trips(db: AsyncSession, driver: User) -> Dict[str, Any]:
+        """Récupère les trajets d'un conducteur et ses totaux (agrégés en SQL)"""
         if not driver.is_driver:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -243,34 +315,81 @@ class TripService:
             )
         
         # Trajets actifs
-        active_trips = db.query(Trip).filter(
+        active_trips = (await db.scalars(select(Trip).where(
             Trip.driver_id == driver.id,
             Trip.status.in_([TripStatus.ACTIVE, TripStatus.FULL]),
             Trip.departure_datetime > datetime.now()
-        ).order_by(asc(Trip.departure_datetime)).all()
+        ).order_by(asc(Trip.departure_datetime)))).all()
         
         # Trajets terminés
-        completed_trips = db.query(Trip).filter(
+        completed_trips = (await db.scalars(select(Trip).where(
             Trip.driver_id == driver.id,
             Trip.status == TripStatus.COMPLETED
-        ).order_by(desc(Trip.departure_datetime)).limit(10).all()
+        ).order_by(desc(Trip.departure_datetime)).limit(10))).all()
         
         # Trajets annulés
-        cancelled_trips = db.query(Trip).filter(
+        cancelled_trips = (await db.scalars(select(Trip).where(
             Trip.driver_id == driver.id,
             Trip.status == TripStatus.CANCELLED
-        ).order_by(desc(Trip.cancelled_at)).limit(5).all()
+        ).order_by(desc(Trip.cancelled_at)).limit(5))).all()
+        
+        # Totaux sur tout l'historique en un seul aller-retour (les listes sont tronquées)
+        is_completed = Trip.status == TripStatus.COMPLETED
+        totals = (await db.execute(select(
+            func.count().label("total_trips"),
+            func.coalesce(func.sum(Trip.driver_earnings).filter(is_completed), 0).label("total_earnings"),
+            func.coalesce(
+                func.sum(Trip.total_seats - Trip.available_seats).filter(is_completed), 0
+            ).label("total_passengers")
+        ).where(Trip.driver_id == driver.id))).one()
         
         return {
             "active_trips": active_trips,
             "completed_trips": completed_trips,
-            "cancelled_trips": cancelled_trips
+            "cancelled_trips": cancelled_trips,
+            "total_trips": totals.total_trips,
+            "total_earnings": float(totals.total_earnings),
+            "total_passengers": int(totals.total_passengers)
         }
 
     @staticmethod
-    def get_trip_stats(db: Session, trip_id: int, driver: User) -> Dict[str, Any]:
+    async def get_popular_routes(db: AsyncSession, limit: int = 10) -> List[Dict[str, Any]]:
+        """Routes les plus fréquentes (hors annulations), via le cache Redis si disponible"""
+        redis_client = get_async_redis()
+        
+        if redis_client is not None:
+            try:
+                cached = await redis_client.get(POPULAR_ROUTES_CACHE_KEY)
+            except redis.RedisError:
+                cached = None
+            if cached:
+                return json.loads(cached)[:limit]
+        
+        result = await db.execute(_POPULAR_ROUTES_SQL, {"limit": POPULAR_ROUTES_MAX})
+        
+        routes = [
+            {
+                "departure_city": route["departure_city"],
+                "arrival_city": route["arrival_city"],
+                "trip_count": route["trip_count"],
+                "avg_price": float(route["avg_price"]) if route["avg_price"] else 0,
+                "route": f"{route['departure_city']} → {route['arrival_city']}"
+            }
+            for route in result.mappings()
+        ]
+        
+        if redis_client is not None:
+            try:
+                await redis_client.setex(POPULAR_ROUTES_CACHE_KEY, POPULAR_ROUTES_CACHE_TTL, json.dumps(routes))
+            except redis.RedisError:
+                pass
+        
+        return routes[:limit]
+
+    @staticmethod
+    async def get_trip_stats(db: AsyncSession, trip_id: int, driver: User) -> Dict[str, Any]:
         """Récupère les statistiques d'un trajet"""
-        trip = TripService.get_trip_by_id(db, trip_id)
+        trip = await TripService.get_trip_by_id(db, trip_id)
         
         if trip.driver_id != driver.id:
             raise HTTPException(
@@ -292,9 +411,9 @@ class TripService:
         }
 
     @staticmethod
-    def mark_trip_as_started(db: Session, trip_id: int, driver: User) -> Trip:
+    async def mark_trip_as_started(db: AsyncSession, trip_id: int, driver: User) -> Trip:
         """Marque un trajet comme commencé"""
-        trip = TripService.get_trip_by_id(db, trip_id)
+        trip = await TripService.get_trip_by_id(db, trip_id)
         
         if trip.driver_id != driver.id:
             raise HTTPException(
@@ -311,14 +430,14 @@ class TripService:
         trip.status = TripStatus.STARTED
         trip.actual_departure_time = datetime.now()
         
-        db.commit()
+        await db.commit()
         
         return trip
 
     @staticmethod
-    def mark_trip_as_completed(db: Session, trip_id: int, driver: User) -> Trip:
+    async def mark_trip_as_completed(db: AsyncSession, trip_id: int, driver: User) -> Trip:
         """Marque un trajet comme terminé"""
-        trip = TripService.get_trip_by_id(db, trip_id)
+        trip = await TripService.get_trip_by_id(db, trip_id)
         
         if trip.driver_id != driver.id:
             raise HTTPException(
@@ -338,7 +457,7 @@ class TripService:
         # Calculer les gains finaux
         trip.calculate_earnings()
         
-        db.commit()
+        await db.commit()
         
         return trip
 
@@ -0,0 +1,38 @@
+"""
+Utilitaires géographiques
+Calculs de distance haversine (scalaire et vectorisé NumPy)
+"""
+import math
+import numpy as np
+
+# Rayon moyen de la Terre en km
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Distance haversine entre deux points (version scalaire)
+    Retourne la distance en kilomètres
+    """
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    dlat = lat2_rad - lat1_rad
+    dlon = math.radians(lon2 - lon1)
+
+    a = (math.sin(dlat / 2) ** 2 +
+         math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2) ** 2)
+    return EARTH_RADIUS_KM * 2 * math.asin(math.sqrt(a))
+
+
+def haversine_np(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Distance haversine vectorisée (tableaux ou scalaires, avec broadcasting)
+    Permet de calculer N distances en un seul passage NumPy
+    Retourne les distances en kilomètres
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(a))
@@ -0,0 +1,10 @@
+"""
+Utilitaires de sérialisation
+Encodage JSON compact des corps de réponse pré-calculés
+"""
+import json
+
+
+def json_bytes(content) -> bytes:
+    """Sérialise comme JSONResponse (UTF-8, sans espaces ni échappement des accents)"""
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")